@@ -1,10 +1,17 @@
+from functools import lru_cache
 from netsquid.nodes.connections import Connection
 from netsquid.components.cchannel import ClassicalChannel
 from netsquid.components.models.delaymodels import FibreDelayModel
 
 
+@lru_cache(maxsize=None)
+def fibre_delay_model(refractive_index):
+    # models only read the channel length, so fibres share one instance
+    return FibreDelayModel(c=299792/refractive_index)
+
+
 class ClassicalFibre (Connection):
-    def __init__(self, name, length, refractive_index=1.45):
+    def __init__(self, name, length, refractive_index=1.45, one_way=False):
         super().__init__(name)
 
         if refractive_index < 1:
@@ -13,16 +20,17 @@ class ClassicalFibre (Connection):
         A2B_channel_name = f'{name}_A2B'
         A2B_channel = self._prepare_channel(
             A2B_channel_name, length, refractive_index)
-        
-        B2A_channel_name = f'{name}_B2A'
-        B2A_channel = self._prepare_channel(
-            B2A_channel_name, length, refractive_index)
-        
         self.add_subcomponent(
             A2B_channel, name=A2B_channel_name,
             forward_input=[('A', 'send')],
             forward_output=[('B', 'recv')],
         )
+        if one_way:
+            return
+        
+        B2A_channel_name = f'{name}_B2A'
+        B2A_channel = self._prepare_channel(
+            B2A_channel_name, length, refractive_index)
         self.add_subcomponent(
             B2A_channel, name=B2A_channel_name,
             forward_input=[('B', 'send')],
@@ -35,7 +43,7 @@ class ClassicalFibre (Connection):
             name=name,
             length=length,
             models={
-                'delay_model': FibreDelayModel(c=299792/refractive_index)
+                'delay_model': fibre_delay_model(refractive_index)
             }
         )
         return channel
@@ -14,6 +14,10 @@ from netsquid.components.models.qerrormodels import DepolarNoiseModel, QuantumEr
 from netsquid.qubits import qubitapi as qapi
 from netsquid.qubits.operators import X as X_op
 from collections import defaultdict, deque
+from functools import lru_cache
+import heapq
+import itertools
+from pydynaa import EventType, EventExpression
 
 
 from simlog import log
@@ -33,15 +37,124 @@ def program_function(num_qubits, priority, reason=None):
                 else self.prog_reason if hasattr(self, 'prog_reason')
                 else 'other'
             )
-            prog = QuantumProgram(num_qubits)
-            qindices = prog.get_qubit_indices(num_qubits)
+            # without a fixed size the program spans the whole mapping
+            size = num_qubits if num_qubits is not None else len(qubit_mapping)
+            prog = RecordedProgram(size)
+            qindices = prog.get_qubit_indices(size)
             prog_func(self, prog, qindices, *args, **kwargs)
-            yield from self.node.qmemory.schedule_program(prog, priority, qubit_mapping, _reason)
-            return prog.output
+            return (yield from self.node.qmemory.schedule_program(prog, priority, qubit_mapping, _reason))
         return program_executor
     return program_function_decorator
 
 
+class RecordedProgram (QuantumProgram):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ops = []
+
+    def apply(self, instruction, qubit_indices=0, output_key=None, **kwargs):
+        # kept so the processor can replay the program inside a fused one
+        self.ops.append((instruction, qubit_indices, output_key, kwargs))
+        super().apply(instruction, qubit_indices, output_key=output_key, **kwargs)
+
+
+class UsageTimeline:
+    def __init__(self, capacity=None, bin_width=None, initial_size=1024):
+        self.capacity = capacity
+        self.bin_width = bin_width
+        self.reasons = dict()
+        self._count = 0
+        self._written = 0
+        if bin_width is not None:
+            self.bins = np.zeros((0, 0))
+        else:
+            size = capacity if capacity is not None else initial_size
+            self.start = np.zeros(size, dtype=np.float64)
+            self.duration = np.zeros(size, dtype=np.float64)
+            self.reason = np.zeros(size, dtype=np.int16)
+
+    def append(self, start, duration, reason):
+        code = self.reasons.setdefault(reason, len(self.reasons))
+        self._written += 1
+        if self.bin_width is not None:
+            self._add_to_bins(start, duration, code)
+            return
+
+        if self.capacity is not None:
+            # ring buffer, the oldest entries are overwritten
+            i = (self._written - 1) % self.capacity
+            self._count = min(self._count + 1, self.capacity)
+        else:
+            i = self._count
+            if i == len(self.start):
+                self._grow(2 * len(self.start))
+            self._count += 1
+        self.start[i] = start
+        self.duration[i] = duration
+        self.reason[i] = code
+
+    def _grow(self, size):
+        for name in ['start', 'duration', 'reason']:
+            old = getattr(self, name)
+            new = np.zeros(size, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def _add_to_bins(self, start, duration, code):
+        end = start + duration
+        first = int(start // self.bin_width)
+        last = int(end // self.bin_width) if duration > 0 else first
+        rows = max(last + 1, self.bins.shape[0])
+        cols = max(code + 1, self.bins.shape[1])
+        if (rows, cols) != self.bins.shape:
+            if rows > self.bins.shape[0]:
+                rows = max(rows, 2 * self.bins.shape[0])
+            bins = np.zeros((rows, cols))
+            bins[:self.bins.shape[0], :self.bins.shape[1]] = self.bins
+            self.bins = bins
+        # the duration is split over every bin the usage overlaps
+        for b in range(first, last + 1):
+            lo = max(start, b * self.bin_width)
+            hi = min(end, (b + 1) * self.bin_width)
+            self.bins[b, code] += hi - lo
+
+    def __len__(self):
+        return self._written if self.bin_width is not None else self._count
+
+    def __iter__(self):
+        start, duration, reason = self.arrays()
+        names = list(self.reasons)
+        for t, d, r in zip(start.tolist(), duration.tolist(), reason.tolist()):
+            yield (t, d, names[r])
+
+    def arrays(self):
+        if self.bin_width is not None:
+            raise ValueError('A binned timeline keeps no individual entries, use bins')
+        if self.capacity is not None and self._written > self.capacity:
+            # unroll the ring so the entries come out in time order
+            i = self._written % self.capacity
+            order = np.r_[i:self.capacity, 0:i]
+            return self.start[order], self.duration[order], self.reason[order]
+        n = self._count
+        return self.start[:n], self.duration[:n], self.reason[:n]
+
+    def columns(self, prefix=''):
+        columns = {f'{prefix}reasons': np.array(list(self.reasons), dtype=str)}
+        if self.bin_width is not None:
+            used = int(np.max(np.nonzero(self.bins.any(axis=1))[0], initial=-1)) + 1
+            columns[f'{prefix}bins'] = self.bins[:used]
+            columns[f'{prefix}bin_width'] = np.array(self.bin_width)
+        else:
+            start, duration, reason = self.arrays()
+            columns[f'{prefix}start'] = start
+            columns[f'{prefix}duration'] = duration
+            columns[f'{prefix}reason'] = reason
+        return columns
+
+    def save(self, path):
+        np.savez_compressed(path, **self.columns())
+
+
 class BitFlipNoise (QuantumErrorModel):
     def __init__(self, error_rate):
         super().__init__()
@@ -52,120 +165,160 @@ class BitFlipNoise (QuantumErrorModel):
             qapi.apply_pauli_noise(q, (1-self.error_rate, self.error_rate, 0, 0))
 
 
+class _ProgramTicket:
+    def __init__(self, program, qubit_mapping, reason):
+        self.turn = EventType('PROGRAM_TURN', 'Queued program may start')
+        self.program = program
+        self.qubit_mapping = qubit_mapping
+        self.reason = reason
+        self.output = None
+        self.dispatched = False
+        self.cancelled = False
+        self.fused = False
+
+
+class _Partition:
+    def __init__(self, positions):
+        self.mask = sum(1 << pos for pos in positions)
+        self.size = len(positions)
+        self.freed = EventType('SLOT_FREED', 'A position of the partition was freed')
+        self.waiting = False
+
+
+def _depolar(F):
+    if F == 1:
+        return None
+    return DepolarNoiseModel(time_independent=True, depolar_rate=1-F)
+
+
+# bounded, a sweep over many timings or fidelities would otherwise keep
+# every instruction set and noise model it ever built alive
+@lru_cache(maxsize=128)
+def _memory_noise(T1, T2):
+    return T1T2NoiseModel(T1, T2)
+
+
+@lru_cache(maxsize=32)
+def _topologies(centre_count, num_in_centre):
+    num_mem = centre_count * num_in_centre
+    centre = np.repeat(np.arange(centre_count), num_in_centre)
+    # every ordered pair of memory positions, split by whether they share a centre
+    ctrl, tgt = np.divmod(np.arange(num_mem * num_mem), num_mem)
+    same = centre[ctrl] == centre[tgt]
+    intra = same & (ctrl != tgt)
+    inter = ~same
+    return dict(
+        memory=list(range(num_mem)),
+        photon=list(range(num_mem, num_mem + centre_count)),
+        emit=list(zip(range(num_mem), (num_mem + centre).tolist())),
+        intra=list(zip(ctrl[intra].tolist(), tgt[intra].tolist())),
+        inter=list(zip(ctrl[inter].tolist(), tgt[inter].tolist()))
+    )
+
+
+@lru_cache(maxsize=128)
+def _instruction_set(
+    centre_count, num_in_centre,
+    t_gate, t_CX, t_init, t_readout, t_iCX,
+    F_gate, F_CX, F_init, F_readout, F_iCX
+):
+    # processors with the same signature share their instructions and noise models
+    topo = _topologies(centre_count, num_in_centre)
+    gate_model = _depolar(F_gate)
+    return tuple([
+        # PHOTON
+        PhysicalInstruction(
+            INSTR_INIT, duration=0, parallel=True,
+            topology=topo['photon']
+        ),
+        PhysicalInstruction(
+            INSTR_CNOT, duration=0, parallel=True,
+            topology=topo['emit']
+        ),
+        # INTRA CENTRE
+        PhysicalInstruction(
+            INSTR_INIT, duration=t_init, parallel=False,
+            topology=topo['memory'],
+            quantum_noise_model=_depolar(F_init)
+        )
+    ] + [
+        PhysicalInstruction(
+            gate, duration=t_gate, parallel=False,
+            topology=topo['memory'],
+            quantum_noise_model=gate_model
+        )
+        for gate in [
+            INSTR_X, INSTR_Y, INSTR_Z, INSTR_H,
+            INSTR_ROT_X, INSTR_ROT_Y, INSTR_ROT_Z, INSTR_ROT
+        ]
+    ] + [
+        PhysicalInstruction(
+            INSTR_CNOT, duration=t_CX, parallel=False,
+            topology=topo['intra'],
+            quantum_noise_model=_depolar(F_CX)
+        ),
+        PhysicalInstruction(
+            INSTR_MEASURE, duration=t_readout, parallel=False,
+            topology=topo['memory'],
+            quantum_noise_model=BitFlipNoise(1-F_readout),
+            apply_q_noise_after=False,
+        ),
+        # INTER CENTRE
+        PhysicalInstruction(
+            INSTR_CNOT, duration=t_iCX, parallel=False,
+            topology=topo['inter'],
+            quantum_noise_model=_depolar(F_iCX)
+        )
+    ])
+
+
 class NVCProcessor (QuantumProcessor):
     def __init__(self,
         T1, T2, num_in_centre,
         t_gate, t_CX, t_init, t_readout,
         F_gate=1, F_CX=1, F_init=1, F_readout=1,
         centre_count=1, F_iCX=None, t_iCX=None,
-        scheduler_dt=0.1, name=None, **kwargs
+        fuse_programs=False, timeline_capacity=None, timeline_bin=None,
+        name=None, **kwargs
     ):
-        num_qubits = centre_count * (num_in_centre + 1)
-        num_mem = centre_count * num_in_centre
-
-        gate_model = (
-            None if F_gate == 1
-            else DepolarNoiseModel(
-                time_independent=True,
-                depolar_rate=1-F_gate
-            )
+        # without values of its own the inter centre CNOT is the intra one
+        t_iCX = t_CX if t_iCX is None else t_iCX
+        F_iCX = F_CX if F_iCX is None else F_iCX
+        instr = _instruction_set(
+            centre_count, num_in_centre,
+            t_gate, t_CX, t_init, t_readout, t_iCX,
+            F_gate, F_CX, F_init, F_readout, F_iCX
         )
-        instr = [
-            # PHOTON
-            PhysicalInstruction(
-                INSTR_INIT, duration=0, parallel=True,
-                topology=list(range(num_mem, num_qubits))
-            ),
-            PhysicalInstruction(
-                INSTR_CNOT, duration=0, parallel=True,
-                topology=[
-                    (i*num_in_centre+q, num_mem+i)
-                    for i in range(centre_count)
-                    for q in range(num_in_centre)
-                ]
-            ),
-            # INTRA CENTRE
-            PhysicalInstruction(
-                INSTR_INIT, duration=t_init, parallel=False,
-                topology=list(range(num_mem)),
-                quantum_noise_model=
-                    None if F_init == 1
-                    else DepolarNoiseModel(
-                        time_independent=True,
-                        depolar_rate=1-F_init
-                    )
-            )
-        ] + [
-            PhysicalInstruction(
-                gate, duration=t_gate, parallel=False,
-                topology=list(range(num_mem)),
-                quantum_noise_model=gate_model
-            )
-            for gate in [
-                INSTR_X, INSTR_Y, INSTR_Z, INSTR_H,
-                INSTR_ROT_X, INSTR_ROT_Y, INSTR_ROT_Z, INSTR_ROT
-            ]
-        ] + [
-            PhysicalInstruction(
-                INSTR_CNOT, duration=t_CX, parallel=False,
-                topology=[
-                    (c*num_in_centre+i, c*num_in_centre+j)
-                    for c in range(centre_count)
-                    for i in range(num_in_centre)
-                    for j in range(num_in_centre)
-                    if i != j
-                ],
-                quantum_noise_model=
-                    None if F_CX == 1
-                    else DepolarNoiseModel(
-                        time_independent=True,
-                        depolar_rate=1-F_CX
-                    )
-            ),
-            PhysicalInstruction(
-                INSTR_MEASURE, duration=t_readout, parallel=False,
-                topology=list(range(num_mem)),
-                quantum_noise_model=BitFlipNoise(1-F_readout),
-                apply_q_noise_after=False,
-            ),
-            # INTER CENTRE
-            PhysicalInstruction(
-                INSTR_CNOT, duration=t_iCX, parallel=False,
-                topology=[
-                    (c1*num_in_centre+i, c2*num_in_centre+j)
-                    for c1 in range(centre_count)
-                    for c2 in range(centre_count)
-                    if c1 != c2
-                    for i in range(num_in_centre)
-                    for j in range(num_in_centre)
-                ],
-                quantum_noise_model=
-                    None if F_iCX == 1
-                    else DepolarNoiseModel(
-                        time_independent=True,
-                        depolar_rate=1-F_iCX
-                    )
-            )
-        ]
 
         super().__init__(
             name=name,
             num_positions=centre_count*(num_in_centre+1),
-            mem_noise_models=T1T2NoiseModel(T1, T2),
-            phys_instructions=instr,
+            mem_noise_models=_memory_noise(T1, T2),
+            phys_instructions=list(instr),
             #fallback_to_nonphysical=True,
             **kwargs
         )
         self.log_layer = log.Layer.PHYSICAL
-        self.scheduler_dt = scheduler_dt
         self.size = num_in_centre * centre_count
         self.num_in_centre = num_in_centre
         self.centre_count = centre_count
+        self.T1, self.T2 = T1, T2
+        self.F_gate, self.F_CX, self.F_readout = F_gate, F_CX, F_readout
+        self.pairs = dict()
         self.busy_subscribers = []
+        self._program_queue = []
+        self._program_seq = itertools.count()
+        self._program_running = False
+        self.fuse_programs = fuse_programs
+        self._durations = dict(
+            gate=t_gate, CX=t_CX, init=t_init, readout=t_readout,
+            iCX=t_iCX
+        )
         self.usage_info = defaultdict(int)
-        self.usage_timeline = deque()
-        for mem in self.mem_positions:
-            mem.in_use_event_enabled = True
+        self.usage_timeline = UsageTimeline(timeline_capacity, timeline_bin)
+        # free memory positions as a bitmask, partitions are masks over it
+        self._free_mask = (1 << self.size) - 1
+        self._partitions = dict()
 
     def add_busy_subscriber(self, callback):
         self.busy_subscribers.append(callback)
@@ -174,31 +327,152 @@ class NVCProcessor (QuantumProcessor):
         self.busy_subscribers.remove(callback)
 
     def schedule_program(self, program, priority, qubit_mapping, reason):
-        while self.busy:
-            end_time = self.sequence_end_time
-            end_time += self.scheduler_dt * priority.value
-            log.info(f'Program execution delayed until {end_time}', at=self)
-            yield Protocol().await_timer(end_time=end_time)
-        prog_ev = self.execute_program(
-            program, qubit_mapping=qubit_mapping
-        )
-        self.register_usage(
-            reason, ns.sim_time(),
-            self.sequence_end_time - ns.sim_time()
-        )
-        for callback in self.busy_subscribers:
-            callback()
-        yield prog_ev
+        if self._program_running:
+            # queued by priority then arrival, the finishing program hands
+            # the processor directly to the next one
+            ticket = _ProgramTicket(program, qubit_mapping, reason)
+            heapq.heappush(
+                self._program_queue,
+                (priority.value, next(self._program_seq), ticket)
+            )
+            log.info('Program queued, %s waiting', len(self._program_queue), at=self)
+            try:
+                yield EventExpression(source=self, event_type=ticket.turn)
+            except GeneratorExit:
+                # the waiting protocol was stopped, pass the turn on if it
+                # was already handed over
+                ticket.cancelled = True
+                if ticket.dispatched and not ticket.fused:
+                    self._dispatch_program()
+                raise
+            if ticket.fused:
+                return ticket.output
+        self._program_running = True
+
+        members = [_ProgramTicket(program, qubit_mapping, reason)]
+        try:
+            while self.busy:
+                yield Protocol().await_timer(end_time=self.sequence_end_time)
+            if self.fuse_programs and isinstance(program, RecordedProgram):
+                members += self._take_fusable(qubit_mapping)
+
+            if len(members) > 1:
+                run_program, run_mapping = self._fuse(members)
+            else:
+                run_program, run_mapping = program, qubit_mapping
+            prog_ev = self.execute_program(
+                run_program, qubit_mapping=run_mapping
+            )
+            duration = self.sequence_end_time - ns.sim_time()
+            if len(members) > 1:
+                # memory instructions are not parallel, fusion only saves
+                # the dispatch of the queued programs and they still run
+                # back to back, so their usage is laid out in that order
+                start = ns.sim_time()
+                for ticket in members:
+                    estimate = self._estimate_duration(ticket)
+                    self.register_usage(ticket.reason, start, estimate)
+                    start += estimate
+                log.info('Fused %s programs', len(members), at=self)
+            else:
+                self.register_usage(reason, ns.sim_time(), duration)
+            for callback in self.busy_subscribers:
+                callback()
+            yield prog_ev
+
+            if len(members) > 1:
+                self._split_output(run_program, members)
+                for ticket in members[1:]:
+                    if not ticket.cancelled:
+                        self._schedule_now(ticket.turn)
+                return members[0].output
+        finally:
+            self._dispatch_program()
         return program.output
+
+    def _take_fusable(self, qubit_mapping):
+        # programs are taken in dispatch order, positions of anything left
+        # in the queue stay blocked so nothing overtakes an earlier program
+        blocked = set(qubit_mapping)
+        taken = []
+        for _, _, ticket in sorted(self._program_queue):
+            if ticket.cancelled:
+                continue
+            if (
+                isinstance(ticket.program, RecordedProgram)
+                and blocked.isdisjoint(ticket.qubit_mapping)
+            ):
+                ticket.fused = ticket.dispatched = True
+                taken.append(ticket)
+            blocked.update(ticket.qubit_mapping)
+
+        if taken:
+            self._program_queue = [
+                entry for entry in self._program_queue if not entry[2].fused
+            ]
+            heapq.heapify(self._program_queue)
+        return taken
+
+    def _fuse(self, members):
+        fused = RecordedProgram(sum(len(t.qubit_mapping) for t in members))
+        offset = 0
+        for k, ticket in enumerate(members):
+            for instruction, indices, output_key, kwargs in ticket.program.ops:
+                if isinstance(indices, int): indices = indices + offset
+                else: indices = [i + offset for i in indices]
+                fused.apply(
+                    instruction, indices,
+                    output_key=None if output_key is None else f'{k}/{output_key}',
+                    **kwargs
+                )
+            offset += len(ticket.qubit_mapping)
+        return fused, [pos for t in members for pos in t.qubit_mapping]
+
+    def _split_output(self, fused, members):
+        for ticket in members:
+            ticket.output = dict()
+        for key, value in fused.output.items():
+            k, sep, name = str(key).partition('/')
+            if sep and k.isdigit():
+                members[int(k)].output[name] = value
+
+    def _estimate_duration(self, ticket):
+        duration = 0
+        for instruction, indices, _, _ in ticket.program.ops:
+            indices = [indices] if isinstance(indices, int) else indices
+            positions = [ticket.qubit_mapping[i] for i in indices]
+            if any(pos >= self.size for pos in positions):
+                continue
+            if instruction is INSTR_INIT:
+                duration += self._durations['init']
+            elif instruction is INSTR_MEASURE:
+                duration += self._durations['readout']
+            elif instruction is INSTR_CNOT:
+                [c1, c2] = [pos // self.num_in_centre for pos in positions]
+                duration += self._durations['CX' if c1 == c2 else 'iCX']
+            else:
+                duration += self._durations['gate']
+        return duration
+
+    def _dispatch_program(self):
+        while self._program_queue:
+            _, _, ticket = heapq.heappop(self._program_queue)
+            if not ticket.cancelled:
+                ticket.dispatched = True
+                self._schedule_now(ticket.turn)
+                return
+        self._program_running = False
     
     def register_usage(self, reason, start, duration):
-        pass
         self.usage_info[reason] += duration
-        self.usage_timeline.append((start, duration, reason))
+        self.usage_timeline.append(start, duration, reason)
 
     def photon_pos(self, centre=0):
         return self.num_in_centre * self.centre_count + centre
     
+    def centre_of(self, pos):
+        return pos // self.num_in_centre
+
     def centre_partition(self, centre=0):
         return list(range(
             centre*self.num_in_centre,
@@ -212,36 +486,85 @@ class NVCProcessor (QuantumProcessor):
         return self.pop(self.photon_pos(centre))
 
     def allocate(self, count=1, partition=None):
-        if partition: positions = partition
-        else: positions = range(self.size)
+        part = self._partition(partition)
 
-        if count > len(positions):
+        if count > part.size:
             raise QuantumMemoryError('Not enough space in partition.')
         if count == 0:
             return []
-        
-        allocated = []
-        for pos in positions:
-            mem = self.mem_positions[pos]
-            if not mem.in_use:
-                allocated.append(pos)
-                mem.in_use = True
-                count -= 1
-            if count == 0:
-                log.info(f'Allocated qubits at positions {allocated}', at=self)
-                return allocated
-        
-        raise QuantumMemoryError('Not enough free space in quantum processor.')
+
+        allocated = self._take_free(part, count)
+        if len(allocated) < count:
+            # positions may have been emptied behind our back, e.g. by discard
+            self._sync_free()
+            allocated += self._take_free(part, count - len(allocated))
+        if len(allocated) < count:
+            for pos in allocated:
+                self.mem_positions[pos].in_use = False
+                self._free_mask |= 1 << pos
+            raise QuantumMemoryError('Not enough free space in quantum processor.')
+        log.info('Allocated qubits at positions %s', allocated, at=self)
+        return allocated
     
     def deallocate(self, qubits):
         if not qubits:
             return
         for q in qubits:
             self.mem_positions[q].in_use = False
-        log.info(f'Deallocated qubits at positions {qubits}', at=self)
+            self.pairs.pop(q, None)
+            self._release(q)
+        log.info('Deallocated qubits at positions %s', qubits, at=self)
+
+    def await_free(self, partition=None):
+        part = self._partition(partition)
+        part.waiting = True
+        return EventExpression(source=self, event_type=part.freed)
+
+    def _partition(self, partition):
+        key = tuple(partition) if partition else None
+        part = self._partitions.get(key)
+        if part is None:
+            part = _Partition(partition if partition else range(self.size))
+            self._partitions[key] = part
+        return part
+
+    def _take_free(self, part, count):
+        taken = []
+        free = self._free_mask & part.mask
+        while free and len(taken) < count:
+            lowest = free & -free
+            free ^= lowest
+            self._free_mask ^= lowest
+            pos = lowest.bit_length() - 1
+            # filled outside allocate, e.g. by put, the mask was stale
+            if self.mem_positions[pos].in_use:
+                continue
+            self.mem_positions[pos].in_use = True
+            taken.append(pos)
+        return taken
+
+    def _release(self, pos):
+        bit = 1 << pos
+        if self._free_mask & bit:
+            return
+        self._free_mask |= bit
+        # one event per partition, and only if somebody is waiting on it
+        for part in self._partitions.values():
+            if part.waiting and part.mask & bit:
+                part.waiting = False
+                self._schedule_now(part.freed)
+
+    def _sync_free(self):
+        for pos in range(self.size):
+            if not self.mem_positions[pos].in_use:
+                self._release(pos)
 
     def destroy(self, qubits):
         if not qubits:
             return
         self.discard(qubits)
-        log.info(f'Destroyed qubits at positions {qubits}', at=self)
+        for q in qubits:
+            self.pairs.pop(q, None)
+            if not self.mem_positions[q].in_use:
+                self._release(q)
+        log.info('Destroyed qubits at positions %s', qubits, at=self)
@@ -1,52 +1,70 @@
 
 from netsquid.nodes.connections import Connection
 from netsquid.components.qchannel import QuantumChannel
-from netsquid.components.models.delaymodels import FibreDelayModel
 from netsquid.components.models.qerrormodels import DepolarNoiseModel, FibreLossModel
+from functools import lru_cache
 import numpy as np
 
+from .classical_fibre import fibre_delay_model
+
+
+@lru_cache(maxsize=None)
+def _depolar_model(length, L0):
+    return DepolarNoiseModel(
+        time_independent=True,
+        depolar_rate=1-np.exp(-length/L0)
+    )
+
+
+@lru_cache(maxsize=None)
+def _loss_model(attenuation):
+    return FibreLossModel(
+        p_loss_init=0, # TODO
+        p_loss_length=attenuation
+    )
+
 
 class QuantumFibre (Connection):
-    def __init__ (self, name, length, attenuation=0.2, depolarizing_coeff=100, refractive_index=1.45):
+    def __init__ (self, name, length, attenuation=0.2, depolarizing_coeff=100, refractive_index=1.45, lossless=False, one_way=False):
         super().__init__(name)
 
         if refractive_index < 1:
             raise ValueError('Refractive index must be greater than 1')
         
         self.L0 = depolarizing_coeff
+        self._length = length
+        self._attenuation = attenuation
+        # loss is then sampled by the sender before the photon is created
+        self.lossless = lossless
         
         A2B_channel_name = f'{name}_A2B'
         A2B_channel = self._prepare_channel(
             A2B_channel_name, length, attenuation, refractive_index)
-        
-        B2A_channel_name = f'{name}_B2A'
-        B2A_channel = self._prepare_channel(
-            B2A_channel_name, length, attenuation, refractive_index)
-        
         self.add_subcomponent(
             A2B_channel, name=A2B_channel_name,
             forward_input=[('A', 'send')],
             forward_output=[('B', 'recv')],
         )
+        if one_way:
+            return
+        
+        B2A_channel_name = f'{name}_B2A'
+        B2A_channel = self._prepare_channel(
+            B2A_channel_name, length, attenuation, refractive_index)
         self.add_subcomponent(
             B2A_channel, name=B2A_channel_name,
             forward_input=[('B', 'send')],
             forward_output=[('A', 'recv')],
         )
 
+    def transmittance(self):
+        return 10**(-self._attenuation*self._length/10)
+
     def _prepare_channel(self, name, length, attenuation, refractive_index):
-        return QuantumChannel(
-            name=name,
-            length=length,
-            models={
-                'quantum_noise_model': DepolarNoiseModel(
-                    time_independent=True,
-                    depolar_rate=1-np.exp(-length/self.L0)
-                ),
-                'delay_model': FibreDelayModel(c=299792/refractive_index),
-                'quantum_loss_model': FibreLossModel(
-                    p_loss_init=0, # TODO
-                    p_loss_length=attenuation
-                )
-            }
-        )
\ No newline at end of file
+        models = {
+            'quantum_noise_model': _depolar_model(length, self.L0),
+            'delay_model': fibre_delay_model(refractive_index)
+        }
+        if not self.lossless:
+            models['quantum_loss_model'] = _loss_model(attenuation)
+        return QuantumChannel(name=name, length=length, models=models)
@@ -81,7 +81,7 @@ class BB84Protocol(QKDProtocol):
         self.cport.tx_output(Message(
             msg, header=BB84Protocol.MSG_HEADER
         ))
-        log.info(log.msg2str(msg), outof=self)
+        log.info(log.msg2str, msg, outof=self)
 
     def _recieve_msg(self, label):
         while True:
@@ -90,7 +90,7 @@ class BB84Protocol(QKDProtocol):
             if not msg: continue
 
             if msg.items[0] == label:
-                log.info(log.msg2str(msg.items), into=self)
+                log.info(log.msg2str, msg.items, into=self)
                 return msg.items[1]
 
     def _split_key(self, same_base):
@@ -0,0 +1,209 @@
+import numpy as np
+import netsquid as ns
+
+
+# Coefficients are indexed by the Pauli error on the second qubit of the
+# pair, with index (x << 1) | z: PHI_PLUS, PHI_MINUS, PSI_PLUS, PSI_MINUS.
+PHI_PLUS = 0
+PHI_MINUS = 1
+PSI_PLUS = 2
+PSI_MINUS = 3
+
+UNIFORM = np.full(4, 0.25)
+
+
+def from_dm(dm):
+    dm = np.real(dm)
+    phi = (dm[0,0] + dm[3,3]) / 2
+    psi = (dm[1,1] + dm[2,2]) / 2
+    return np.array([
+        phi + dm[0,3],
+        phi - dm[0,3],
+        psi + dm[1,2],
+        psi - dm[1,2]
+    ])
+
+
+def to_dm(coeffs):
+    [a, d, c, b] = coeffs
+    dm = np.zeros((4,4), dtype=np.complex128)
+    dm[0,0] = dm[3,3] = (a + d) / 2
+    dm[0,3] = dm[3,0] = (a - d) / 2
+    dm[1,1] = dm[2,2] = (c + b) / 2
+    dm[1,2] = dm[2,1] = (c - b) / 2
+    return dm
+
+
+def fidelity(coeffs):
+    return coeffs[PHI_PLUS]
+
+
+def depolarize(coeffs, prob):
+    return (1 - prob) * coeffs + prob * UNIFORM
+
+
+def dephase(coeffs, prob):
+    return (1 - prob) * coeffs + prob * coeffs[[1, 0, 3, 2]]
+
+
+def swap(coeffs1, coeffs2):
+    # the Pauli errors of the two pairs multiply, which is a XOR on the index
+    out = np.zeros(4)
+    for i in range(4):
+        for j in range(4):
+            out[i ^ j] += coeffs1[i] * coeffs2[j]
+    return out
+
+
+def dejmps(coeffs1, coeffs2):
+    [a1, d1, c1, b1] = coeffs1
+    [a2, d2, c2, b2] = coeffs2
+    out = np.array([
+        a1*a2 + b1*b2,
+        a1*b2 + b1*a2,
+        c1*c2 + d1*d2,
+        c1*d2 + d1*c2
+    ])
+    p = np.sum(out)
+    return p, out / p
+
+
+def dejmps_odd(coeffs1, coeffs2):
+    # the pair left behind when the two readouts disagree, which is
+    # what gets kept after a readout error flips the parity decision
+    [a1, d1, c1, b1] = coeffs1
+    [a2, d2, c2, b2] = coeffs2
+    out = np.array([
+        a1*c2 + b1*d2,
+        a1*d2 + b1*c2,
+        c1*a2 + d1*b2,
+        c1*b2 + d1*a2
+    ])
+    p = np.sum(out)
+    # perfect pairs never disagree, any state does for a zero weight
+    return p, out / p if p > 0 else UNIFORM
+
+
+def bitflip(coeffs, prob):
+    return (1 - prob) * coeffs + prob * coeffs[[2, 3, 0, 1]]
+
+
+# Gate noise is depolarising on every qubit a gate acts on, applied after
+# the gate. On a qubit that is read out next it only matters through its
+# X or Y part, which flips the outcome with half the depolarising
+# probability, and through a Hadamard the Z part turns into that flip.
+# On a qubit that carries on it depolarises its pair, which commutes with
+# single qubit gates, so rotation noise can be moved to the input pairs.
+
+def measured_flip(F_readout, *F_gates):
+    # chance of a wrong outcome from the readout and the depolarising
+    # gates the qubit went through since its last two qubit gate
+    q = 1 - F_readout
+    for F in F_gates:
+        p = (1 - F) / 2
+        q = q * (1 - p) + p * (1 - q)
+    return q
+
+
+def noisy_swap(coeffs1, coeffs2, F_gate=1, F_CX=1, F_readout=1):
+    # CNOT, H on the control, then both readouts, the X correction comes
+    # from the target and the Z correction from the control
+    coeffs = swap(coeffs1, coeffs2)
+    coeffs = bitflip(coeffs, measured_flip(F_readout, F_CX))
+    return dephase(coeffs, measured_flip(F_readout, F_CX, F_gate))
+
+
+def noisy_dejmps(coeffs1, coeffs2, F_gate=1, F_CX=1, F_readout=1):
+    # rotations on both qubits of both nodes, the CNOT and the readout of
+    # the second pair on both nodes, a flipped outcome on one side flips
+    # the parity decision and keeps the odd output instead
+    coeffs1 = depolarize(coeffs1, 1 - F_gate**2)
+    coeffs2 = depolarize(coeffs2, 1 - F_gate**2)
+    p, out = dejmps(coeffs1, coeffs2)
+    q, odd = dejmps_odd(coeffs1, coeffs2)
+    r = measured_flip(F_readout, F_CX)
+    flip = 2 * r * (1 - r)
+    p_keep = (1 - flip) * p + flip * q
+    coeffs = ((1 - flip) * p * out + flip * q * odd) / p_keep
+    return p_keep, depolarize(coeffs, 1 - F_CX**2)
+
+
+class BellPair:
+    def __init__(self, coeffs, qmem1, pos1, qmem2, pos2):
+        self.coeffs = np.asarray(coeffs, dtype=float)
+        self.ends = [(qmem1, pos1), (qmem2, pos2)]
+        self.time = ns.sim_time()
+        self.keep = None
+        for qmem, pos in self.ends:
+            qmem.pairs[pos] = self
+
+    def update(self):
+        dt = ns.sim_time() - self.time
+        if dt > 0:
+            for qmem, _ in self.ends:
+                self.coeffs = dephase(self.coeffs, (1 - np.exp(-dt/qmem.T2)) / 2)
+            self.time = ns.sim_time()
+        return self.coeffs
+
+    def other_end(self, qmem):
+        [end1, end2] = self.ends
+        return end2 if end1[0] is qmem else end1
+
+    def dm(self):
+        return to_dm(self.update())
+
+    def fidelity(self):
+        return fidelity(self.update())
+
+
+def pair_at(qmem, pos):
+    pairs = getattr(qmem, 'pairs', None)
+    return pairs.get(pos) if pairs else None
+
+
+def swap_pairs(qmem, pos1, pos2):
+    pair1 = pair_at(qmem, pos1)
+    pair2 = pair_at(qmem, pos2)
+    if pair1 is None or pair2 is None:
+        return None
+
+    # gate and readout errors show up as wrong corrections on the far end
+    coeffs = noisy_swap(
+        pair1.update(), pair2.update(),
+        qmem.F_gate, qmem.F_CX, qmem.F_readout
+    )
+
+    (qmem1, far1) = pair1.other_end(qmem)
+    (qmem2, far2) = pair2.other_end(qmem)
+    return BellPair(coeffs, qmem1, far1, qmem2, far2)
+
+
+def purify_pairs(qmem, pos1, pos2):
+    kept = pair_at(qmem, pos1)
+    measured = pair_at(qmem, pos2)
+    if kept is None or measured is None:
+        return None
+
+    # the node that gets here first decides for both ends, the other end
+    # reports a matching or mismatching result
+    if measured.keep is not None:
+        return 0 if measured.keep else 1
+
+    p_keep, coeffs = noisy_dejmps(
+        kept.update(), measured.update(),
+        qmem.F_gate, qmem.F_CX, qmem.F_readout
+    )
+    measured.keep = np.random.rand() < p_keep
+    if measured.keep:
+        kept.coeffs = coeffs
+    return 0
+
+
+def pair_fidelity(qmem1, pos1, qmem2, pos2):
+    pair = pair_at(qmem1, pos1)
+    if pair is not None and pair is pair_at(qmem2, pos2):
+        return pair.fidelity()
+
+    [q1] = qmem1.peek([pos1])
+    [q2] = qmem2.peek([pos2])
+    return ns.qubits.fidelity([q1, q2], ns.qubits.ketstates.b00, squared=True)
@@ -4,6 +4,7 @@ from .link_base import *
 from .simple import *
 from .state_insertion import *
 from .link_purification import *
+from .purified_insertion import *
 
 __all__ = [
     # link_layer.py
@@ -25,5 +26,9 @@ __all__ = [
     'StateInsertionProtocol'
 
     # link_purification.py
-    'LinkWithPurification'
+    'LinkWithPurification',
+
+    # purified_insertion.py
+    'PurificationModel',
+    'PurifiedInsertionProtocol'
 ]
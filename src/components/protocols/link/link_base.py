@@ -44,7 +44,7 @@ class LinkBase (LinkLayer):
                 qubits=qubits,
                 tries=tries
             )
-            log.info(f'Link delivered {count} qubits', at=self)
+            log.info('Link delivered %s qubits', count, at=self)
 
     def _handle_consecutive_request(self, req):
         count = req.count
@@ -59,9 +59,9 @@ class LinkBase (LinkLayer):
                     tries=tries
                 )
                 if count == 1:
-                    log.info(f'Link delivered qubit #{count} (last): {qubit.id}', at=self)
+                    log.info('Link delivered qubit #%s (last): %s', count, qubit.id, at=self)
                 else:
-                    log.info(f'Link delivered qubit #{count}: {qubit.id}', at=self)
+                    log.info('Link delivered qubit #%s: %s', count, qubit.id, at=self)
                 count -= 1
 
     def _handle_infinite_consecutive_request(self, req):
@@ -74,7 +74,7 @@ class LinkBase (LinkLayer):
                     qubit=qubit,
                     tries=tries
                 )
-                log.info(f'Link delivered qubit: {qubit}', at=self)
+                log.info('Link delivered qubit: %s', qubit, at=self)
 
     def _timeout_generator(self, req, gen, timeout):
         timeout_expr = self.await_timer(timeout)
@@ -90,9 +90,4 @@ class LinkBase (LinkLayer):
             try:
                 return self.node.qmemory.allocate(count, self.partition)
             except QuantumMemoryError:
-                if self.partition: poss = self.partition
-                else: poss = self.node.qmemory.memory_positions()
-                yield self.await_mempos_in_use_toggle(
-                    qmemory=self.node.qmemory,
-                    positions=list(poss)
-                )
\ No newline at end of file
+                yield self.node.qmemory.await_free(self.partition)
\ No newline at end of file
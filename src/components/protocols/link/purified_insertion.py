@@ -0,0 +1,87 @@
+import numpy as np
+from netsquid.util.simtools import SECOND
+
+from components.hardware import SPEED_OF_LIGHT
+from .. import bell_diagonal as bd
+from .state_insertion import *
+from .state_insertion import _GenerationRecord
+
+
+class PurificationModel:
+    def __init__(self,
+        link_desc, ladder_iter, greedy_iter=1,
+        distance=0, refractive_index=1.45,
+        t_gate=0, t_CX=0, t_readout=0,
+        F_gate=1, F_CX=1, F_readout=1
+    ):
+        self.link_desc = link_desc
+        self.liter = ladder_iter
+        self.giter = greedy_iter
+
+        # one DEJMPS round: both rotations, the CNOT and the readout on the
+        # processors, then the one way trip of the measurement results
+        self.t_round = (
+            2*t_gate + t_CX + t_readout
+            + distance * refractive_index / SPEED_OF_LIGHT * SECOND
+        )
+
+        self.levels = [bd.from_dm(link_desc.dm)]
+        self.p_keep = []
+        for _ in range(ladder_iter):
+            base = self.levels[-1]
+            state = base
+            p_level = []
+            for _ in range(greedy_iter):
+                p_keep, state = bd.noisy_dejmps(state, base, F_gate, F_CX, F_readout)
+                p_level.append(p_keep)
+            self.levels.append(state)
+            self.p_keep.append(p_level)
+
+        self.coeffs = self.levels[-1]
+        self.dm = bd.to_dm(self.coeffs)
+
+    def fidelity(self):
+        return bd.fidelity(self.coeffs)
+
+    def sample(self, draw_tries, rng):
+        return self._sample_level(self.liter, draw_tries, rng)
+
+    def _sample_level(self, level, draw_tries, rng):
+        if level == 0:
+            tries = draw_tries()
+            return tries * self.link_desc.clk, tries
+
+        time, tries = self._sample_level(level-1, draw_tries, rng)
+        k = 0
+        while k < self.giter:
+            t, n = self._sample_level(level-1, draw_tries, rng)
+            time += t + self.t_round
+            tries += n
+            if rng.random() < self.p_keep[level-1][k]:
+                k += 1
+            else:
+                # both pairs are dropped, the level starts over
+                t, n = self._sample_level(level-1, draw_tries, rng)
+                time += t
+                tries += n
+                k = 0
+        return time, tries
+
+
+class PurifiedInsertionProtocol (StateInsertionProtocol):
+    def __init__(self, node1, node2, purification_model, fast_forward=False, seed=None, compact=False, name=None):
+        super().__init__(
+            node1, node2, purification_model.link_desc,
+            fast_forward=fast_forward, seed=seed, compact=compact, name=name
+        )
+        self.model = purification_model
+
+    def _add_generation_record(self, rec1, rec2):
+        ready_time, tries = self.model.sample(self._next_tries, self.rng)
+
+        gen = _GenerationRecord(ready_time, tries, rec1, rec2, etgmid('link'))
+        self.gens.add(gen)
+        self.send_signal(StateInsertionProtocol._GEN_ADDED)
+
+    def _heralded_dm(self):
+        return self.model.dm
@@ -11,6 +11,9 @@ class SimPLE (LinkBase):
     def __init__(self, node, physical_protocol, partition=None, name=None) -> None:
         super().__init__(node, partition, name)
         self.add_subprotocol(physical_protocol, name='physical_protocol')
+        self._in_flight = deque()
+        self._heralded = deque()
+        self._tries = 0
 
     def run(self):
         self.start_subprotocols()
@@ -18,19 +21,78 @@ class SimPLE (LinkBase):
 
     def _share_entanglement(self, req):
         phys_proto = self.subprotocols['physical_protocol']
-        [pos] = yield from self._allocate_qubits(1)
+        if phys_proto.pipeline_depth > 1:
+            return (yield from self._share_pipelined(req, phys_proto))
+
+        positions = yield from self._allocate_qubits(phys_proto.modes)
         tries = 0
         while not req.cancelled:
             resp = yield from (phys_proto
-                .attempt_entanglement(pos)
+                .attempt_entanglement(*positions)
                 .await_as(self)
             )
-            tries += 1
+            tries += resp.attempts
             if resp.result == PhysicalLayer.SUCCESS:
+                # the first heralded mode is kept, the others are released
+                self.node.qmemory.deallocate([
+                    pos for pos in positions if pos != resp.position
+                ])
                 return EntanglementRecord(resp.position, resp.etgm_id), tries
         
-        self.node.qmemory.deallocate([pos])
+        self.node.qmemory.deallocate(positions)
         return None, None
     
+    def _share_pipelined(self, req, phys_proto):
+        while not req.cancelled:
+            self._collect_attempts(phys_proto)
+            if self._heralded:
+                return self._heralded.popleft()
+
+            # keep as many attempts in flight as the memory allows
+            while len(self._in_flight) < phys_proto.pipeline_depth:
+                try:
+                    positions = self.node.qmemory.allocate(phys_proto.modes, self.partition)
+                except QuantumMemoryError:
+                    break
+                self._in_flight.append(phys_proto.attempt_entanglement(*positions))
+            if not self._in_flight:
+                positions = yield from self._allocate_qubits(phys_proto.modes)
+                self._in_flight.append(phys_proto.attempt_entanglement(*positions))
+                continue
+
+            yield self.await_signal(
+                sender=phys_proto,
+                signal_label=PhysicalLayer.ATTEMPTED_EG
+            )
+
+        return None, None
+
+    def _collect_attempts(self, phys_proto):
+        # answers are read off the requests in the order they were issued
+        for attempt in [a for a in self._in_flight if a.response is not None]:
+            self._in_flight.remove(attempt)
+            resp = attempt.response
+            self._tries += resp.attempts
+            if resp.result == PhysicalLayer.SUCCESS:
+                self.node.qmemory.deallocate([
+                    pos for pos in attempt.positions if pos != resp.position
+                ])
+                self._heralded.append((
+                    EntanglementRecord(resp.position, resp.etgm_id), self._tries
+                ))
+                self._tries = 0
+            else:
+                self._in_flight.append(phys_proto.attempt_entanglement(*attempt.positions))
+
     def _reset_link(self):
-        pass
+        # neither attempts in flight nor pairs heralded ahead of demand
+        # outlive the request
+        while self._in_flight:
+            attempt = self._in_flight.popleft()
+            attempt.cancelled = True
+            self.node.qmemory.deallocate(attempt.positions)
+        self._tries = 0
+        while self._heralded:
+            record, _ = self._heralded.popleft()
+            self.node.qmemory.destroy([record.position])
+            self.node.qmemory.deallocate([record.position])
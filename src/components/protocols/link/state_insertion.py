@@ -1,6 +1,7 @@
 
 import numpy as np
-from collections import namedtuple, deque
+from bisect import bisect_left
+from collections import namedtuple, deque, OrderedDict
 from sortedcontainers import SortedKeyList
 from netsquid.protocols import NodeProtocol, ServiceProtocol
 from netsquid.qubits.dmtools import DenseDMRepr
@@ -10,6 +11,7 @@ from netsquid.util.simtools import SECOND, MICROSECOND
 from components.hardware.nvcprocessor import NVCProcessor
 
 from .link_base import *
+from .. import bell_diagonal as bd
 
 
 _GenerationRecord = namedtuple('AttemptRecord', ['ready_time', 'tries', 'rec1', 'rec2', 'etgm_id'])
@@ -23,7 +25,7 @@ class StateInsertionLocalProxy (LinkBase):
 
     def _share_entanglement(self, req):
         [pos] = yield from self._allocate_qubits(1)
-        log.info(f'Allocated qubit at {pos}', at=self)
+        log.info('Allocated qubit at %s', pos, at=self)
         self.parent.start_attempts(self.node, req.id, pos)
         yield self.await_signal(
             sender=self.parent,
@@ -37,6 +39,9 @@ class StateInsertionLocalProxy (LinkBase):
 
 
 class LinkDescriptor:
+    cache_size = 1024
+    _cache = OrderedDict()
+
     def __init__ (self,
         distance,
         qfc_eff, collection_eff, detection_eff,
@@ -44,35 +49,118 @@ class LinkDescriptor:
         L0, T1, T2,
         attenuation=0.2, refractive_index=1.45,
         clk=None
+    ):
+        self.clk, self.dm, self.p = LinkDescriptor._herald(
+            distance,
+            qfc_eff, collection_eff, detection_eff,
+            init_time, init_fidelity, correction_time,
+            L0, T1, T2,
+            attenuation, refractive_index, clk
+        )
+
+    @staticmethod
+    def cached(
+        distance,
+        qfc_eff, collection_eff, detection_eff,
+        init_time, init_fidelity, correction_time,
+        L0, T1, T2,
+        attenuation=0.2, refractive_index=1.45,
+        clk=None
+    ):
+        key = (
+            distance,
+            qfc_eff, collection_eff, detection_eff,
+            init_time, init_fidelity, correction_time,
+            L0, T1, T2,
+            attenuation, refractive_index, clk
+        )
+        cache = LinkDescriptor._cache
+        desc = cache.get(key)
+        if desc is not None:
+            cache.move_to_end(key)
+            return desc
+
+        desc = LinkDescriptor(*key)
+        LinkDescriptor._store(key, desc)
+        return desc
+
+    @staticmethod
+    def grid(
+        distances,
+        qfc_eff, collection_eff, detection_eff,
+        init_time, init_fidelity, correction_time,
+        L0, T1, T2,
+        attenuation=0.2, refractive_index=1.45,
+        clk=None
+    ):
+        params = (
+            qfc_eff, collection_eff, detection_eff,
+            init_time, init_fidelity, correction_time,
+            L0, T1, T2,
+            attenuation, refractive_index, clk
+        )
+        distances = np.asarray(distances, dtype=float)
+        clks, dms, ps = LinkDescriptor._herald(distances, *params)
+        clks = np.broadcast_to(clks, distances.shape)
+
+        descs = []
+        for distance, clk, dm, p in zip(distances, clks, dms, ps):
+            desc = LinkDescriptor.__new__(LinkDescriptor)
+            desc.clk, desc.dm, desc.p = float(clk), dm, float(p)
+            LinkDescriptor._store((float(distance), *params), desc)
+            descs.append(desc)
+        return descs
+
+    @staticmethod
+    def clear_cache():
+        LinkDescriptor._cache.clear()
+
+    @staticmethod
+    def _store(key, desc):
+        cache = LinkDescriptor._cache
+        cache[key] = desc
+        cache.move_to_end(key)
+        while len(cache) > LinkDescriptor.cache_size:
+            cache.popitem(last=False)
+
+    @staticmethod
+    def _herald(
+        distance,
+        qfc_eff, collection_eff, detection_eff,
+        init_time, init_fidelity, correction_time,
+        L0, T1, T2,
+        attenuation, refractive_index, clk
     ):
         travel_time = distance * refractive_index / 3e8 * SECOND
         l = distance / 2
         t = (travel_time + correction_time) / SECOND
 
-        self.clk = (clk if clk is not None 
+        clk = (clk if clk is not None 
             else init_time + correction_time + travel_time)
-        
+
         # coefficients
         kap = 1 - np.exp(-l/L0)
         lam = 1 - np.exp(t/T1 - 2*t/T2)
         gam = 1 - np.exp(-t/T1)
         eta = init_fidelity
-        
+
         # state after successful heralding
         A = (eta - 2)**2
         B = (1 - gam)**2 * (2*kap - kap**2)
 
-        dm = np.zeros((4,4), dtype=np.complex128)
-        dm[0,0] = dm[3,3] = 2*(1 - gam) - B
-        dm[1,1] = 4 * gam + B
-        dm[2,2] = B
-        dm[0,3] = dm[3,0] =  2 * eta**2 / A * (1-gam) * (1-lam) * (1-kap)**2
-        self.dm = dm * 0.25
+        dm = np.zeros(np.shape(distance) + (4,4), dtype=np.complex128)
+        dm[...,0,0] = dm[...,3,3] = 2*(1 - gam) - B
+        dm[...,1,1] = 4 * gam + B
+        dm[...,2,2] = B
+        dm[...,0,3] = dm[...,3,0] = 2 * eta**2 / A * (1-gam) * (1-lam) * (1-kap)**2
+        dm = dm * 0.25
 
         # success probability
-        self.p = 0.5 * ( qfc_eff * collection_eff * detection_eff
+        p = 0.5 * ( qfc_eff * collection_eff * detection_eff
             * 10**(-attenuation*l/10) ) ** 2
 
+        return clk, dm, p
+
 
 class StateInsertionProtocol (LocalProtocol):
     ETGM_READY = 'ETGM_READY'
@@ -80,8 +168,9 @@ class StateInsertionProtocol (LocalProtocol):
     _NODE_RESET = 'NODE_RESET'
     _PROC_BUSY = 'PROC_BUSY'
 
+    TRIES_BLOCK = 4096
 
-    def __init__(self, node1, node2, link_desc,  name=None):
+    def __init__(self, node1, node2, link_desc, fast_forward=False, seed=None, compact=False, name=None):
         super().__init__(
             dict(node1=node1, node2=node2), name
         )
@@ -95,10 +184,23 @@ class StateInsertionProtocol (LocalProtocol):
         self.attempts2 = deque()
         self.gens = SortedKeyList(key=lambda item: item.ready_time)
         self.link_desc = link_desc
+        self.fast_forward = fast_forward
+        self.compact = compact
+        self._busy_periods = []
+        # without an explicit seed the stream is drawn from the global
+        # generator, so np.random.seed still reproduces a whole network
+        self.rng = np.random.default_rng(
+            seed if seed is not None else np.random.randint(2**32))
+        self._tries = []
+        self._tries_idx = 0
         node1.qmemory.add_busy_subscriber(self._proc_busy_cb)
         node2.qmemory.add_busy_subscriber(self._proc_busy_cb)
 
     def run(self):
+        if self.fast_forward:
+            yield from self._run_fast_forward()
+            return
+
         while True:
             yield self._gen_added_event()
             while len(self.gens) > 0:
@@ -143,12 +245,62 @@ class StateInsertionProtocol (LocalProtocol):
                 
                 t_prog = busy_proc.sequence_end_time - ns.sim_time()
                 self.t_halt = max(self.t_halt, t_prog)
-                log.info(f'Halting for {self.t_halt/MICROSECOND} us, {busy_proc.name} is busy', at=self)
+                log.info('Halting for %s us, %s is busy', self.t_halt/MICROSECOND, busy_proc.name, at=self)
             else:
                 self.gens.clear()
                 break
 
 
+    def _run_fast_forward(self):
+        while True:
+            yield self._gen_added_event()
+            while len(self.gens) > 0:
+                gen = self.gens.pop(0)
+                yield from self._fast_forward_generation(gen)
+
+    def _fast_forward_generation(self, gen):
+        start_time = ns.sim_time()
+        insert_time, _ = self._project_generation(start_time, gen.ready_time)
+        while True:
+            expr = yield self.await_timer(end_time=insert_time) | self._reset_event()
+            if not expr.first_term.value:
+                self.gens.clear()
+                return
+
+            # programs started since the timer was armed may have pushed
+            # the insertion back, every busy period before now is known
+            insert_time, idle = self._project_generation(start_time, gen.ready_time)
+            if insert_time <= ns.sim_time():
+                break
+            log.info('Generation delayed until %s us', insert_time/MICROSECOND, at=self)
+
+        self._register_generation(idle)
+        self._insert_state(gen)
+
+    def _project_generation(self, start, duration):
+        # drop periods that started before the generation, the regular
+        # engine does not halt for programs that were already running
+        first = bisect_left(self._busy_periods, (start, -1))
+        del self._busy_periods[:first]
+
+        t = start
+        idle = []
+        for (busy_start, busy_end) in self._busy_periods:
+            if busy_start - t >= duration:
+                break
+            if busy_start > t:
+                idle.append((t, busy_start - t))
+                duration -= busy_start - t
+            t = max(t, busy_end)
+
+        idle.append((t, duration))
+        return t + duration, idle
+
+    def _register_generation(self, idle):
+        for start, duration in idle:
+            self.node1.qmemory.register_usage('state_insertion', start, duration)
+            self.node2.qmemory.register_usage('state_insertion', start, duration)
+
     def _gen_added_event(self):
         return self.await_signal(
             sender=self,
@@ -198,6 +350,7 @@ class StateInsertionProtocol (LocalProtocol):
 
     def reset(self, node):
         self.gens.clear()
+        self._busy_periods.clear()
         if node == self.node1:
             self.attempts1.clear()
         elif node == self.node2:
@@ -207,21 +360,40 @@ class StateInsertionProtocol (LocalProtocol):
         self.send_signal(StateInsertionProtocol._NODE_RESET)
 
     def _add_generation_record(self, rec1, rec2):
-        # TODO proper implementation of overflow protection (*0.999)
-        link = self.link_desc
-        u = np.random.rand()*0.999
-        tries = np.ceil( np.log(1-u) / np.log(1-link.p) )
+        tries = self._next_tries()
         ready_time = tries * self.link_desc.clk
 
-        gen = _GenerationRecord(ready_time, int(tries), rec1, rec2, etgmid('link'))
+        gen = _GenerationRecord(ready_time, tries, rec1, rec2, etgmid('link'))
         self.gens.add(gen)
         self.send_signal(StateInsertionProtocol._GEN_ADDED)
 
+    def _next_tries(self):
+        if self._tries_idx == len(self._tries):
+            self._tries = self.rng.geometric(
+                self.link_desc.p, size=StateInsertionProtocol.TRIES_BLOCK
+            ).tolist()
+            self._tries_idx = 0
+        tries = self._tries[self._tries_idx]
+        self._tries_idx += 1
+        return tries
+
+    def _heralded_dm(self):
+        return self.link_desc.dm
+
     def _insert_state(self, gen):
-        dm = np.copy(self.link_desc.dm)
-        repr = DenseDMRepr(dm=dm)
         qubits = create_qubits(2)
-        assign_qstate(qubits, repr)
+        if self.compact:
+            # the qubits stay in |0> as placeholders for the programs,
+            # the pair state is carried by the Bell-diagonal coefficients
+            bd.BellPair(
+                bd.from_dm(self._heralded_dm()),
+                self.node1.qmemory, gen.rec1.pos,
+                self.node2.qmemory, gen.rec2.pos
+            )
+        else:
+            dm = np.copy(self._heralded_dm())
+            repr = DenseDMRepr(dm=dm)
+            assign_qstate(qubits, repr)
 
         self.node1.qmemory.put(qubits[0], [gen.rec1.pos])
         self.node2.qmemory.put(qubits[1], [gen.rec2.pos])
@@ -230,7 +402,17 @@ class StateInsertionProtocol (LocalProtocol):
             StateInsertionProtocol.ETGM_READY,
             result=gen
         )
-        log.info(f'State inserted into {gen.rec1.pos}@{self.node1.name} and {gen.rec2.pos}@{self.node2.name}', at=self)
+        log.info('State inserted into %s@%s and %s@%s', gen.rec1.pos, self.node1.name, gen.rec2.pos, self.node2.name, at=self)
 
     def _proc_busy_cb(self):
-        self.send_signal(StateInsertionProtocol._PROC_BUSY)
+        if self.fast_forward:
+            # the callback can fire once a program already finished
+            end_time = max((
+                proc.sequence_end_time
+                for proc in [self.node1.qmemory, self.node2.qmemory]
+                if proc.busy
+            ), default=ns.sim_time())
+            if end_time > ns.sim_time():
+                self._busy_periods.append((ns.sim_time(), end_time))
+        else:
+            self.send_signal(StateInsertionProtocol._PROC_BUSY)
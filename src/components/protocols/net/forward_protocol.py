@@ -26,6 +26,6 @@ class ForwardProtocol(NodeProtocol):
                 for header in self.headers:
                     msg = self.node.ports[port_in].rx_input(header=header)
                     if msg:
-                        log.info(log.msg2str(msg.items), into=self)
+                        log.info(log.msg2str, msg.items, into=self)
                         self.node.ports[port_out].tx_output(msg)
-                        log.info(log.msg2str(msg.items), outof=self)
+                        log.info(log.msg2str, msg.items, outof=self)
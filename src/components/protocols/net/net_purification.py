@@ -29,7 +29,7 @@ class NetWithPurification (NetworkLayer):
             self.net_req = self.net_proto.initiate_sharing()
             msg = [NetWithPurification.INIT_MSG, dict(count=req.count)]
             self.cport.tx_output(Message(msg, header=NetWithPurification.PURIFY_HEADER))
-            log.info(log.msg2str(msg), outof=self)
+            log.info(log.msg2str, msg, outof=self)
         elif req.req_label == RoutingRole.TAILEND:
             self.net_req = self.net_proto.recieve()
             while True:
@@ -38,7 +38,7 @@ class NetWithPurification (NetworkLayer):
                 if not msg:
                     continue
                 req.count = msg.items[1]['count']
-                log.info(log.msg2str(msg.items), into=self)
+                log.info(log.msg2str, msg.items, into=self)
                 break
         else:
             raise ValueError(f'Unknown role: {req.req_label}')
@@ -59,7 +59,7 @@ class NetWithPurification (NetworkLayer):
             if expr.first_term.value:
                 resp = self.net_req.get_answare(self)
                 self.purify_proto.add_pair(resp.qubit)
-                log.info(f'Added qubit to purification: {resp.qubit}', at=self)
+                log.info('Added qubit to purification: %s', resp.qubit, at=self)
             else:
                 self.count += 1
                 qubit = self.purify_proto.get_signal_result(
@@ -69,7 +69,7 @@ class NetWithPurification (NetworkLayer):
                     qubit=qubit,
                     final=self.count==req.count
                 )
-                log.info(f'Delivered qubit: {qubit}', at=self)
+                log.info('Delivered qubit: %s', qubit, at=self)
         
         self.net_req.cancelled = True
         self.purify_proto.reset()
@@ -1,5 +1,7 @@
 
 from enum import Enum
+import heapq
+from collections import deque
 import netsquid as ns
 from netsquid.components.component import Message
 from netsquid.components.instructions import INSTR_CNOT, INSTR_H, INSTR_MEASURE
@@ -7,6 +9,7 @@ from netsquid.components.instructions import INSTR_CNOT, INSTR_H, INSTR_MEASURE
 from ..util import *
 from .network_layer import NetworkLayer
 from ..link import LinkResponseType
+from .. import bell_diagonal as bd
 from .swap_with_rep import SwapWithRepeaterProtocol
 from components.hardware import program_function, ProgramPriority
 
@@ -14,7 +17,7 @@ from components.hardware import program_function, ProgramPriority
 class RepeaterProtocol (
     StatefulProtocolTempalte(NodeProtocol),
 ):
-    def __init__(self, node, cport1, link1, cport2, link2, name=None):
+    def __init__(self, node, cport1, link1, cport2, link2, batch_window=0, batch_size=None, name=None):
         self.log_layer = log.Layer.NETWORK
         super().__init__(node, name)
         self.add_subprotocol(_RepEtgmManagerMinion(node, self, f'{self.name}_MNGR'), name='etgm_minion')
@@ -22,6 +25,14 @@ class RepeaterProtocol (
         self.add_subprotocol(link2, name='link2')
         self.cport1_name = cport1
         self.cport2_name = cport2
+        self.batchers = dict()
+        for cport in [cport1, cport2]:
+            batcher = MessageBatcher(
+                node, node.ports[cport], batch_window, batch_size,
+                name=f'{self.name}_{cport}_BATCH'
+            )
+            self.batchers[node.ports[cport]] = batcher
+            self.add_subprotocol(batcher, name=f'batcher_{cport}')
 
     def create_statemachine(self):
         return RepeaterStatemachine(self)
@@ -30,6 +41,12 @@ class RepeaterProtocol (
         self.start_subprotocols()
         yield from super().run()
 
+    def send(self, port, items, header):
+        self.batchers[port].send(items, header)
+
+    def flush(self, port):
+        self.batchers[port].flush()
+
 
 class RepeaterState (Enum):
     IDLE = 'IDLE'
@@ -69,7 +86,7 @@ class RepeaterStatemachine (ProtocolStateMachine):
 
             msg_type = msg.items[0]
             if msg_type == SwapWithRepeaterProtocol.INIT_MSG:
-                log.info(log.msg2str(msg.items), into=self.proto)
+                log.info(log.msg2str, msg.items, into=self.proto)
                 data = msg.items[1]
                 self.session = data['session_id']
                 etgm_minion = self.proto.subprotocols['etgm_minion']
@@ -80,7 +97,7 @@ class RepeaterStatemachine (ProtocolStateMachine):
                     msg_forward,
                     header=NetworkLayer.MSG_HEADER
                 ))
-                log.info(log.msg2str(msg_forward), outof=self.proto)
+                log.info(log.msg2str, msg_forward, outof=self.proto)
                 break
 
         return RepeaterState.SWAPPING
@@ -157,19 +174,20 @@ class RepeaterStatemachine (ProtocolStateMachine):
                 continue
 
             if msg.items[0] == SwapWithRepeaterProtocol.COMPLETE_MSG:
-                log.info(log.msg2str(msg.items), into=self.proto)
+                log.info(log.msg2str, msg.items, into=self.proto)
+                self.proto.flush(port_out)
                 port_out.tx_output(Message(
                     msg.items,
                     header=subheader(NetworkLayer.MSG_HEADER, self.session)
                 ))
-                log.info(log.msg2str(msg.items), outof=self.proto)
+                log.info(log.msg2str, msg.items, outof=self.proto)
                 break
         return RepeaterState.IDLE
 
 
     def _handle_incoming_messages(self, batch_msg, next_hop_port, last_hop_port, track_correction):
         etgm_minion = self.proto.subprotocols['etgm_minion']
-        log.info(log.msg2str(batch_msg.items), into=self.proto)
+        log.info(log.msg2str, batch_msg.items, into=self.proto)
 
         i = 0
         while i < len(batch_msg.items):
@@ -177,11 +195,12 @@ class RepeaterStatemachine (ProtocolStateMachine):
             if msg_type == SwapWithRepeaterProtocol.COMPLETE_MSG:
                 etgm_minion.reset()
                 complete_msg = [SwapWithRepeaterProtocol.COMPLETE_MSG, batch_msg.items[i+1]]
+                self.proto.flush(next_hop_port)
                 next_hop_port.tx_output(Message(
                     complete_msg,
                     header=subheader(NetworkLayer.MSG_HEADER, self.session)
                 ))
-                log.info(log.msg2str(complete_msg), outof=self.proto)
+                log.info(log.msg2str, complete_msg, outof=self.proto)
                 return False
             elif msg_type == SwapWithRepeaterProtocol.DISCARD_MSG:
                 data = batch_msg.items[i + 1]
@@ -196,9 +215,14 @@ class RepeaterStatemachine (ProtocolStateMachine):
 
 
 class _LinkRecord:
-    def __init__(self, qubit, cutoff_time):
+    def __init__(self, qubit, cutoff_time, queue):
         self.qubit = qubit
         self.time = ns.sim_time() + cutoff_time
+        self.queue = queue
+        self.done = False
+
+    def __lt__(self, other):
+        return self.time < other.time
 
     def until_cutoff(self):
         return self.time - ns.sim_time()
@@ -220,6 +244,7 @@ class _SwapRecord:
         self.cZ = cZ
         self.time = ns.sim_time()
         self.tracks = 0
+        self.removed = False
 
 
 class _DiscardRecord:
@@ -241,17 +266,25 @@ class _RepEtgmManagerMinion (NodeProtocol):
 
     def reset(self, init=False):
         if not init:
-            log.info(f'{self._upstream}, {self._downstream}')
+            log.info('%s, %s', self._upstream, self._downstream)
             for link_rec in self._upstream:
                 self.node.qmemory.destroy([link_rec.qubit.position])
             for link_rec in self._downstream:
                 self.node.qmemory.destroy([link_rec.qubit.position])
         
-        self._upstream = []
-        self._downstream = []
-        self._track_queue = []
-        self._swap_records = []
-        self._discard_records = []
+        self._upstream = deque()
+        self._downstream = deque()
+        # pending tracks and records are indexed by qubit id, the deques
+        # keep the swap/discard order needed to prune old records
+        self._track_queue = dict()
+        self._swap_records = dict()
+        self._swap_order = deque()
+        self._discard_records = dict()
+        self._discard_order = deque()
+        # expiry times of both queues, records leave it lazily once swapped
+        self._cutoffs = []
+        self._timer = None
+        self._timer_at = None
         self.send_signal(_RepEtgmManagerMinion._RESET)
 
     def run(self):
@@ -264,81 +297,75 @@ class _RepEtgmManagerMinion (NodeProtocol):
                 sender=self,
                 signal_label=_RepEtgmManagerMinion._RESET
             )
-            next_cutoff = None
-            if len(self._upstream) > 0:
-                next_cutoff = self._upstream[0].time
-            elif len(self._downstream) > 0:
-                next_cutoff = self._downstream[0].time
+            if self._timer_at is not None and self._timer_at <= ns.sim_time():
+                # the timer went off while a swap was running
+                self._timer_at = None
+                self._expire_qubits()
 
+            next_cutoff = self._next_cutoff()
             if next_cutoff is not None:
+                # a single timer is kept armed, it is only replaced when an
+                # earlier deadline shows up
                 next_cutoff = max(next_cutoff, ns.sim_time())
-                qubit_expired = self.await_timer(end_time=next_cutoff)
-                expr = yield link_ready | (qubit_expired | reset_ev)
+                if self._timer_at is None or next_cutoff < self._timer_at:
+                    self._timer_at = next_cutoff
+                    self._timer = self.await_timer(end_time=next_cutoff)
+                expr = yield link_ready | (self._timer | reset_ev)
                 if expr.first_term.value:
                     yield from self._attempt_swap()
                 elif expr.second_term.first_term.value:
-                    self._handle_expired_qubit()
+                    self._timer_at = None
+                    self._expire_qubits()
             else:
                 expr = yield link_ready | reset_ev
                 if expr.first_term.value:
                     yield from self._attempt_swap()
 
     def register_upstream(self, qubit):
-        self._upstream.append(_LinkRecord(qubit, self.cutoff_time))
-        self.send_signal(_RepEtgmManagerMinion._LINK_READY)
+        self._register(qubit, self._upstream)
 
     def register_downstream(self, qubit):
-        self._downstream.append(_LinkRecord(qubit, self.cutoff_time))
+        self._register(qubit, self._downstream)
+
+    def _register(self, qubit, queue):
+        rec = _LinkRecord(qubit, self.cutoff_time, queue)
+        queue.append(rec)
+        heapq.heappush(self._cutoffs, rec)
         self.send_signal(_RepEtgmManagerMinion._LINK_READY)
 
+    def _next_cutoff(self):
+        while self._cutoffs and self._cutoffs[0].done:
+            heapq.heappop(self._cutoffs)
+        return self._cutoffs[0].time if self._cutoffs else None
+
     def discard(self, data, next_hop_port):
-        for i in range(len(self._swap_records)):
-            rec = self._swap_records[i]
-            rec_found = False
-
-            if rec.id1 == data['id']:
-                rec_found = True
-                data['id'] = rec.id2
-            elif rec.id2 == data['id']:
-                rec_found = True
-                data['id'] = rec.id1
-
-            if rec_found:
-                self._swap_records.remove(rec)
-                disc_msg = [SwapWithRepeaterProtocol.DISCARD_MSG, data]
-                next_hop_port.tx_output(Message(
-                    disc_msg,
-                    header=subheader(NetworkLayer.MSG_HEADER, self.session)
-                ))
-                log.info(log.msg2str(disc_msg), outof=self.rep_proto)
-                return
+        rec = self._swap_records.pop(data['id'], None)
+        if rec is None:
+            return
+
+        data['id'] = rec.id2 if rec.id1 == data['id'] else rec.id1
+        self._swap_records.pop(data['id'], None)
+        rec.removed = True
+        disc_msg = [SwapWithRepeaterProtocol.DISCARD_MSG, data]
+        self.rep_proto.send(next_hop_port, disc_msg, subheader(NetworkLayer.MSG_HEADER, self.session))
+        log.info(log.msg2str, disc_msg, outof=self.rep_proto)
 
     def track(self, data, next_hop_port, last_hop_port, track_correction):
         track_rec = _TrackRecord(data, next_hop_port, last_hop_port, track_correction)
 
-        for i in range(len(self._swap_records)):
-            rec = self._swap_records[i]
-            sent = self._track_and_swap(track_rec, rec)
-            if sent:
-                self._tracked(i)
-                return
-                
-        for rec in self._discard_records:
-            sent = self._track_and_discard(track_rec, rec)
-            if sent:
-                self._discard_records.remove(rec)
-                return
-
-        in_up = any(data['id'] == rec.qubit.id for rec in self._upstream)
-        in_down = any(data['id'] == rec.qubit.id for rec in self._downstream)
-
-        #if in_up or in_down:
-        self._track_queue.append(_TrackRecord(
-            data, next_hop_port, last_hop_port, track_correction))
-        log.info(f'Queued: {log.msg2str([SwapWithRepeaterProtocol.TRACK_MSG, data])}', at=self.rep_proto)
-        #else:
-        #    id = data['id']
-        #    raise ValueError(f'Recieved track message for unknown qubit: {id}')
+        rec = self._swap_records.get(data['id'])
+        if rec is not None:
+            self._track_and_swap(track_rec, rec)
+            self._tracked(rec)
+            return
+
+        rec = self._discard_records.pop(data['id'], None)
+        if rec is not None:
+            self._track_and_discard(track_rec, rec)
+            return
+
+        self._track_queue[data['id']] = track_rec
+        log.info(lambda: f'Queued: {log.msg2str([SwapWithRepeaterProtocol.TRACK_MSG, data])}', at=self.rep_proto)
         
     def _track_and_swap(self, track_rec, swap_rec):
         data = track_rec.data
@@ -356,77 +383,121 @@ class _RepEtgmManagerMinion (NodeProtocol):
                 if swap_rec.cX: data['cX'] = not data['cX']
                 if swap_rec.cZ: data['cZ'] = not data['cZ']
             track_msg = [SwapWithRepeaterProtocol.TRACK_MSG, data]
-            track_rec.next_hop_port.tx_output(Message(
-                track_msg,
-                header=subheader(NetworkLayer.MSG_HEADER, self.session)
-            ))
-            log.info(log.msg2str(track_msg), outof=self.rep_proto)
+            self.rep_proto.send(track_rec.next_hop_port, track_msg, subheader(NetworkLayer.MSG_HEADER, self.session))
+            log.info(log.msg2str, track_msg, outof=self.rep_proto)
         return rec_found
     
     def _track_and_discard(self, track_rec, discard_rec):
         data = track_rec.data
         if discard_rec.id == data['id']:
             disc_msg = [SwapWithRepeaterProtocol.DISCARD_MSG, data]
-            track_rec.last_hop_port.tx_output(Message(
-                disc_msg,
-                header=subheader(NetworkLayer.MSG_HEADER, self.session)
-            ))
-            log.info(log.msg2str(disc_msg), outof=self.rep_proto)
+            self.rep_proto.send(track_rec.last_hop_port, disc_msg, subheader(NetworkLayer.MSG_HEADER, self.session))
+            log.info(log.msg2str, disc_msg, outof=self.rep_proto)
             return True
         return False
 
-    def _tracked(self, index):
-        rec = self._swap_records[index]
+    def _tracked(self, rec):
         rec.tracks += 1
-        if rec.tracks == 2:
-            self._swap_records = self._swap_records[index+1:]
-            if len(self._discard_records) > 0: 
-                di = next(i for i, drec in enumerate(self._discard_records) if drec.time >= rec.time)
-                self._discard_records = self._discard_records[di:]
+        if rec.tracks < 2:
+            return
+
+        # both ends know about this swap, it and every older swap can go
+        while self._swap_order:
+            old = self._swap_order.popleft()
+            if not old.removed:
+                for id in (old.id1, old.id2):
+                    if self._swap_records.get(id) is old:
+                        del self._swap_records[id]
+            if old is rec:
+                break
+
+        while self._discard_order and self._discard_order[0].time < rec.time:
+            old = self._discard_order.popleft()
+            if self._discard_records.get(old.id) is old:
+                del self._discard_records[old.id]
 
     def _attempt_swap(self):
-        if len(self._upstream) > 0 and len(self._downstream) > 0:
-            q_up = self._upstream.pop(0).qubit
-            q_down = self._downstream.pop(0).qubit
-            log.info(f'Attempting swap: {q_up.id}, {q_down.id}', at=self.rep_proto)
-            output = yield from self.swap([q_up.position, q_down.position])
-            log.info(f'PROGRAM OUTPUT: {output}', at=self.rep_proto)
-            self.node.qmemory.destroy([q_up.position, q_down.position])
-            rec = _SwapRecord(
-                q_up.id, q_down.id,
-                output['cX']==[1], output['cZ']==[1]
-            )
-            log.info(f'Swapped qubits {q_up.id}, {q_down.id}, cX: {rec.cX}, cZ: {rec.cZ}', at=self.rep_proto)
-
-            to_remove = []
-            for track in self._track_queue:
-                sent = self._track_and_swap(track, rec)
-                if sent:
-                    to_remove.append(track)
-                    #self._track_queue.remove(track)
-            for track in to_remove:
-                self._track_queue.remove(track)
-            self._swap_records.append(rec)
-                
-    def _handle_expired_qubit(self):
-        if len(self._upstream) > 0:
-            rec = self._upstream.pop(0)
-        else:
-            rec = self._downstream.pop(0)
+        # waiting pairs are matched oldest first and swapped by a single
+        # program as long as they use different centres, a centre swaps one
+        # pair at a time, so the rest and late arrivals go into later rounds
+        while True:
+            # qubits may have run past their cutoff during the last round
+            if self._timer_at is not None and self._timer_at <= ns.sim_time():
+                self._timer_at = None
+            self._expire_qubits()
+            if len(self._upstream) == 0 or len(self._downstream) == 0:
+                break
+
+            pairs = []
+            busy = set()
+            while len(self._upstream) > 0 and len(self._downstream) > 0:
+                centres = {
+                    self.node.qmemory.centre_of(queue[0].qubit.position)
+                    for queue in (self._upstream, self._downstream)
+                }
+                if not busy.isdisjoint(centres):
+                    break
+                busy |= centres
+                rec_up = self._upstream.popleft()
+                rec_down = self._downstream.popleft()
+                rec_up.done = rec_down.done = True
+                pairs.append((rec_up.qubit, rec_down.qubit))
+
+            log.info(lambda: 'Attempting swap: ' + ', '.join(
+                f'{q_up.id}, {q_down.id}' for q_up, q_down in pairs
+            ), at=self.rep_proto)
+            output = yield from self.swap([
+                q.position for pair in pairs for q in pair
+            ])
+            log.info('PROGRAM OUTPUT: %s', output, at=self.rep_proto)
+
+            for k, (q_up, q_down) in enumerate(pairs):
+                self._swapped(q_up, q_down, output[f'cX{k}']==[1], output[f'cZ{k}']==[1])
+
+    def _swapped(self, q_up, q_down, cX, cZ):
+        if bd.swap_pairs(self.node.qmemory, q_up.position, q_down.position) is not None:
+            # compact pairs, the coefficients already hold the corrected state
+            cX = cZ = False
+        self.node.qmemory.destroy([q_up.position, q_down.position])
+        rec = _SwapRecord(q_up.id, q_down.id, cX, cZ)
+        log.info('Swapped qubits %s, %s, cX: %s, cZ: %s', q_up.id, q_down.id, rec.cX, rec.cZ, at=self.rep_proto)
+
+        for id in (rec.id1, rec.id2):
+            track = self._track_queue.pop(id, None)
+            if track is not None:
+                self._track_and_swap(track, rec)
+        self._swap_records[rec.id1] = rec
+        self._swap_records[rec.id2] = rec
+        self._swap_order.append(rec)
+
+    def _expire_qubits(self):
+        while self._cutoffs and self._cutoffs[0].time <= ns.sim_time():
+            rec = heapq.heappop(self._cutoffs)
+            if rec.done:
+                continue
+            rec.done = True
+            if rec.queue[0] is rec:
+                rec.queue.popleft()
+            else:
+                rec.queue.remove(rec)
+            self._handle_expired_qubit(rec)
+
+    def _handle_expired_qubit(self, rec):
         discard_rec = _DiscardRecord(rec.qubit.id)
         self.node.qmemory.destroy([rec.qubit.position])
-        log.info(f'Qubit expired: {rec.qubit.id}', at=self.rep_proto)
-        for track in self._track_queue:
-            sent = self._track_and_discard(track, discard_rec)
-            if sent:
-                self._track_queue.remove(track)
-                return
-        self._discard_records.append(discard_rec)
-
-    @program_function(2, ProgramPriority.HIGH, 'swap')
+        log.info('Qubit expired: %s', rec.qubit.id, at=self.rep_proto)
+
+        track = self._track_queue.pop(discard_rec.id, None)
+        if track is not None:
+            self._track_and_discard(track, discard_rec)
+            return
+        self._discard_records[discard_rec.id] = discard_rec
+        self._discard_order.append(discard_rec)
+
+    @program_function(None, ProgramPriority.HIGH, 'swap')
     def swap(self, prog, qubits):
-        [q1, q2] = qubits
-        prog.apply(INSTR_CNOT, [q1, q2])
-        prog.apply(INSTR_H, q1)
-        prog.apply(INSTR_MEASURE, q1, output_key='cZ')
-        prog.apply(INSTR_MEASURE, q2, output_key='cX')
+        for k, (q1, q2) in enumerate(zip(qubits[::2], qubits[1::2])):
+            prog.apply(INSTR_CNOT, [q1, q2])
+            prog.apply(INSTR_H, q1)
+            prog.apply(INSTR_MEASURE, q1, output_key=f'cZ{k}')
+            prog.apply(INSTR_MEASURE, q2, output_key=f'cX{k}')
@@ -17,13 +17,17 @@ class SwapWithRepeaterProtocol (NetworkLayer):
     DISCARD_MSG = 'DISCARD_MSG'
     COMPLETE_MSG = 'COMPLETE_MSG'
 
-    def __init__(self, node, cport, link_protocol, cutoff_time=None, name=None):
+    def __init__(self, node, cport, link_protocol, cutoff_time=None, batch_window=0, batch_size=None, name=None):
         super().__init__(node, name)
         self.add_subprotocol(link_protocol, name='link_protocol')
         self.add_subprotocol(_SWRCorrectionMinion(node, self), name='minion')
         self.cutoff_time = cutoff_time
         self.records = dict()
         self.cport = self.node.ports[cport]
+        self.batcher = MessageBatcher(
+            node, self.cport, batch_window, batch_size, name=f'{self.name}_BATCH'
+        )
+        self.add_subprotocol(self.batcher, name='batcher')
         self.completed = False
 
     def run(self):
@@ -44,7 +48,7 @@ class SwapWithRepeaterProtocol (NetworkLayer):
             self.cport.tx_output(Message(msg,
                 header=NetworkLayer.MSG_HEADER
             ))
-            log.info(log.msg2str(msg), outof=self)
+            log.info(log.msg2str, msg, outof=self)
         elif req.req_label == RoutingRole.TAILEND:
             while True:
                 yield self.await_port_input(self.cport)
@@ -59,7 +63,7 @@ class SwapWithRepeaterProtocol (NetworkLayer):
                 data = msg.items[1]
                 req.count = data['count']
                 req.session_id = data['session_id']
-                log.info(log.msg2str(msg.items), into=self)
+                log.info(log.msg2str, msg.items, into=self)
                 break
         else:
             raise ValueError(f'Unknown role: {req.req_label}')
@@ -121,17 +125,21 @@ class SwapWithRepeaterProtocol (NetworkLayer):
                     cZ=False
                 )
             ]
-        self.cport.tx_output(Message(msg,
-            header=subheader(NetworkLayer.MSG_HEADER, req.session_id)
-        ))
-        log.info(f'Link ready -> {log.msg2str(msg)}', outof=self)
+        self.batcher.send(msg, subheader(NetworkLayer.MSG_HEADER, req.session_id))
+        log.info(lambda: f'Link ready -> {log.msg2str(msg)}', outof=self)
 
     def _handle_incoming_meassage(self, req):
         msg = self.cport.rx_input(header=subheader(NetworkLayer.MSG_HEADER, req.session_id))
         if not msg:
             return
 
-        [msg_type, data] = msg.items
+        # repeaters may pack several TRACK/DISCARD items into one message
+        for msg_type, data in zip(msg.items[::2], msg.items[1::2]):
+            if req.count is not None and self.count >= req.count:
+                break
+            self._handle_item(req, msg_type, data)
+
+    def _handle_item(self, req, msg_type, data):
         minion = self.subprotocols['minion']
 
         if msg_type == SwapWithRepeaterProtocol.TRACK_MSG:
@@ -150,12 +158,12 @@ class SwapWithRepeaterProtocol (NetworkLayer):
                 cZ=data['cZ'],
                 final=self.count==req.count
             )
-            log.info(f'Success #{self.count}: {log.msg2str(msg.items)}', into=self)
+            log.info(lambda: f'Success #{self.count}: {log.msg2str([msg_type, data])}', into=self)
         elif msg_type == SwapWithRepeaterProtocol.DISCARD_MSG:
             id = data['id']
             rec = self.records.pop(id)
             self.node.qmemory.destroy([rec.position])
-            log.info(f'Failed: {log.msg2str(msg.items)}', into=self)
+            log.info(lambda: f'Failed: {log.msg2str([msg_type, data])}', into=self)
         elif msg_type == SwapWithRepeaterProtocol.COMPLETE_MSG:
             self.completed = True
         else:
@@ -166,10 +174,11 @@ class SwapWithRepeaterProtocol (NetworkLayer):
             SwapWithRepeaterProtocol.COMPLETE_MSG,
             dict(session_id=req.session_id)
         ]
+        self.batcher.flush()
         self.cport.tx_output(Message(msg,
             header=subheader(NetworkLayer.MSG_HEADER, req.session_id),
         ))
-        log.info(log.msg2str(msg), outof=self)
+        log.info(log.msg2str, msg, outof=self)
 
     def _await_complete(self, req):
         log.info('Waiting for COMPLETE_MSG', at=self)
@@ -184,7 +193,7 @@ class SwapWithRepeaterProtocol (NetworkLayer):
                 msg_type == SwapWithRepeaterProtocol.COMPLETE_MSG
                 and msg.items[1]['session_id'] == req.session_id
             ):
-                log.info(f'Recieved: {log.msg2str(msg.items)}', into=self)
+                log.info(lambda: f'Recieved: {log.msg2str(msg.items)}', into=self)
                 break
 
 
@@ -197,7 +206,7 @@ class _SWRCorrectionMinion (QueuedProtocol):
         while True:
             yield from self._await_request()
             for req in self._poll_requests():
-                log.info(f'Correcting qubit with: cX: {req.cX}, cZ: {req.cZ}', at=self.net_proto)
+                log.info('Correcting qubit with: cX: %s, cZ: %s', req.cX, req.cZ, at=self.net_proto)
                 if req.cX or req.cZ:
                     yield from self._correct([req.position], req.cX, req.cZ)
                 req.net_req.answare(
@@ -207,7 +216,7 @@ class _SWRCorrectionMinion (QueuedProtocol):
                     ),
                     final=req.final
                 )
-                log.info(f'Pair delivered with id {req.net_id}', at=self.net_proto)
+                log.info('Pair delivered with id %s', req.net_id, at=self.net_proto)
 
     def correct(self, net_req, net_id, position, cX, cZ, final):
         self._push_request(
@@ -2,6 +2,7 @@
 from .physical_layer import *
 from .swap_with_bsa import *
 from .bsa_protocol import *
+from .bsa_engine import *
 
 __all__ = [
     # physical_layer.py
@@ -15,5 +16,9 @@ __all__ = [
     'BSAProtocolStatemachine',
 
     # swap_with_bsa.py
-    'SwapWithBSAProtocol'
+    'SwapWithBSAProtocol',
+
+    # bsa_engine.py
+    'SampledBSAProtocol',
+    'SampledSwapWithBSAProtocol'
 ]
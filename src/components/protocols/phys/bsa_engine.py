@@ -0,0 +1,148 @@
+
+import numpy as np
+import netsquid as ns
+from netsquid.protocols import NodeProtocol
+from netsquid.components.component import Message
+from netsquid.qubits import qubitapi as qapi
+from netsquid.util.simtools import SECOND
+
+from ..util import *
+from .physical_layer import PhysicalLayer
+from .bsa_protocol import BSAProtocol
+from .swap_with_bsa import SwapWithBSAProtocol
+from components.hardware import SPEED_OF_LIGHT
+from simlog import log
+
+
+class SampledBSAProtocol (NodeProtocol):
+    FIRE = 'FIRE'
+    _READY = 'READY'
+    _PHOTON = 'PHOTON'
+
+    TICKS_BLOCK = 4096
+
+    def __init__(self, node, clock, length,
+        attenuation=0.2, depolarizing_coeff=100, refractive_index=1.45,
+        detector_efficiency=1, seed=None, name=None
+    ):
+        self.log_layer = log.Layer.PHYSICAL
+        super().__init__(node, name)
+        self.add_signal(SampledBSAProtocol.FIRE)
+        self.add_signal(SampledBSAProtocol._READY)
+        self.add_signal(SampledBSAProtocol._PHOTON)
+        self.clock = clock
+        self.p_arrive = 10**(-attenuation*length/10)
+        self.p_depolar = 1 - np.exp(-length/depolarizing_coeff)
+        self.travel_time = length * refractive_index / SPEED_OF_LIGHT * SECOND
+        self.detector_eff = detector_efficiency
+        self.rng = np.random.default_rng(
+            seed if seed is not None else np.random.randint(2**32))
+        self._ready = dict()
+        self._photons = dict()
+
+    def ready(self, side, proto):
+        self._ready[side] = proto
+        self.send_signal(SampledBSAProtocol._READY)
+
+    def receive(self, side, photon):
+        self._photons[side] = photon
+        self.send_signal(SampledBSAProtocol._PHOTON)
+
+    def run(self):
+        while True:
+            yield self.await_signal(sender=self, signal_label=SampledBSAProtocol._READY)
+            if len(self._ready) < 2:
+                continue
+
+            # skip straight to the tick where both photons are detected,
+            # the Bell outcome itself is left to the measurement below
+            ticks = self._sample_ticks(
+                self._ready['A'].emission_eff(),
+                self._ready['B'].emission_eff()
+            )
+            fire_time = self.clock.next_tick() + (ticks - 1) * self.clock.delta_time()
+            delay = fire_time - ns.sim_time()
+            if delay > 0:
+                yield self.await_timer(delay)
+            log.info('Firing after %s ticks', ticks, at=self)
+
+            self._ready = dict()
+            self._photons = dict()
+            self.send_signal(SampledBSAProtocol.FIRE, ticks)
+            while len(self._photons) < 2:
+                yield self.await_signal(sender=self, signal_label=SampledBSAProtocol._PHOTON)
+
+            yield self.await_timer(self.travel_time)
+            self._measure(self._photons['A'], self._photons['B'])
+
+    def _sample_ticks(self, effA, effB):
+        ticks = 0
+        while True:
+            r = self.rng.random((SampledBSAProtocol.TICKS_BLOCK, 3))
+            detected = (
+                (r[:,0] < effA * self.p_arrive)
+                & (r[:,1] < effB * self.p_arrive)
+                & (r[:,2] < self.detector_eff**2)
+            )
+            [hits] = np.nonzero(detected)
+            if len(hits) > 0:
+                return ticks + int(hits[0]) + 1
+            ticks += SampledBSAProtocol.TICKS_BLOCK
+
+    def _measure(self, photonA, photonB):
+        if self.p_depolar > 0:
+            qapi.depolarize(photonA, prob=self.p_depolar)
+            qapi.depolarize(photonB, prob=self.p_depolar)
+
+        mem = self.node.qmemory
+        mem.put([photonA, photonB], positions=[0, 1])
+        mem.operate(ns.CNOT, [0, 1])
+        mem.operate(ns.H, 0)
+        [mX, mZ], _ = mem.measure([0, 1])
+        if mZ == 0:
+            log.info('Unsuccessful Bell-state measurement: undistinguishable state', at=self)
+            self._announce(BSAProtocol.FAILURE)
+        else:
+            id = etgmid('link')
+            log.info('Successful Bell-state measurement, assigned id: %s', id, at=self)
+            self._announce(
+                BSAProtocol.SUCCESS,
+                dict(id=id, cX=mZ==1, cZ=mX==1),
+                dict(id=id, cX=False, cZ=False)
+            )
+
+    def _announce(self, result, A=None, B=None):
+        msgA = [result, A] if A else [result]
+        msgB = [result, B] if B else [result]
+        self.node.ports['coutA'].tx_output(Message(msgA, header=PhysicalLayer.MSG_HEADER))
+        log.info(lambda: f'To A: {log.msg2str(msgA)}', outof=self)
+        self.node.ports['coutB'].tx_output(Message(msgB, header=PhysicalLayer.MSG_HEADER))
+        log.info(lambda: f'To B: {log.msg2str(msgB)}', outof=self)
+
+
+class SampledSwapWithBSAProtocol (SwapWithBSAProtocol):
+    def __init__(self, node, engine, side, cport, collection_eff=1, qfc_eff=1, name=None) -> None:
+        super().__init__(node, engine.clock, None, cport, collection_eff, qfc_eff, name=name)
+        self.engine = engine
+        self.side = side
+
+    def emission_eff(self):
+        return self.coll_eff * self.qfc_eff
+
+    def _attempt_entanglement(self, req):
+        mem = self.node.qmemory
+
+        self.engine.ready(self.side, self)
+        yield self.await_signal(
+            sender=self.engine,
+            signal_label=SampledBSAProtocol.FIRE
+        )
+        ticks = self.engine.get_signal_result(SampledBSAProtocol.FIRE, self)
+
+        qubits = [pos, _] = [req.position, mem.photon_pos()]
+        yield from self.prepare_bell_state(qubits)
+        [photon] = mem.pop_photon()
+        self.engine.receive(self.side, photon)
+        log.info('Sent photon', outof=self)
+
+        yield from self._await_herald(req, [pos], ticks)
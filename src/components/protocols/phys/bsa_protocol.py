@@ -1,4 +1,5 @@
 
+import math
 import numpy as np
 import netsquid as ns
 from enum import Enum
@@ -21,15 +22,25 @@ class BSAProtocol(StatefulProtocolTempalte(NodeProtocol)):
     SUCCESS = 'SUCCESS'
     FAILURE = 'FAILURE'
 
-    def __init__(self, node, clock, detection_offset, detection_window, detector_efficiency=1, name=None):
+    def __init__(self, node, clock, detection_offset, detection_window, detector_efficiency=1, modes=1, mode_spacing=0, name=None):
         self.log_layer = log.Layer.PHYSICAL
         super().__init__(node, name)
-        if detection_offset + detection_window > clock.delta_time():
+        # photons may arrive a few ticks after they were sent, the
+        # window is then opened on the tick that lands closest before them
+        period = clock.delta_time()
+        self.delay_ticks = math.floor(detection_offset / period + 1e-9)
+        detection_offset = max(0, detection_offset - self.delay_ticks * period)
+        last_window = detection_offset + (modes - 1) * mode_spacing
+        if last_window + detection_window > period:
             raise ValueError('Detection time exceeds clock period.')
+        if modes > 1 and detection_window > mode_spacing:
+            raise ValueError('Detection windows of consecutive modes overlap.')
         
         self.detection_offset = detection_offset
         self.detection_window = detection_window
         self.detector_eff = detector_efficiency
+        self.modes = modes
+        self.mode_spacing = mode_spacing
         self.clock = clock
 
     def create_statemachine(self):
@@ -47,11 +58,17 @@ class BSAProtocolStatemachine (ProtocolStateMachine):
             sender=self.proto.clock,
             signal_label=Clock.TICK
         )
+        self._tick_time = ns.sim_time()
+        self._tick = self.proto.clock.tick_index() - self.proto.delay_ticks
+        self._heralds = []
         return BSAState.WAITING_OFFSET
     
     @protocolstate(BSAState.WAITING_OFFSET)
     def _waiting_offset(self):
-        yield self.proto.await_timer(self.proto.detection_offset)
+        # each temporal mode has its own detection window within the period
+        mode = len(self._heralds)
+        start = self._tick_time + self.proto.detection_offset + mode * self.proto.mode_spacing
+        yield self.proto.await_timer(max(0, start - ns.sim_time()))
         return BSAState.WAITING_PHOTON_1
     
     @protocolstate(BSAState.WAITING_PHOTON_1, BSAState.WAITING_PHOTON_2)
@@ -71,9 +88,8 @@ class BSAProtocolStatemachine (ProtocolStateMachine):
         if event.second_term.value:
             return self._process_photon()
         else:
-            log.info(f'Unsuccessful Bell-state measurement: photon loss', at=self.proto)
-            self._announce(BSAProtocol.FAILURE)
-            return BSAState.WAITING_TICK
+            log.info('Unsuccessful Bell-state measurement: photon loss', at=self.proto)
+            return self._herald(BSAProtocol.FAILURE)
         
     def _process_photon(self):
         if self.get_state() == BSAState.WAITING_PHOTON_1:
@@ -81,34 +97,42 @@ class BSAProtocolStatemachine (ProtocolStateMachine):
         else:
             detected = np.random.rand() <= self.proto.detector_eff**2
             if not detected:
-                log.info(f'Unsuccessful Bell-state measurement: a detector did not work', at=self.proto)
-                self._announce(BSAProtocol.FAILURE)
-                return BSAState.WAITING_TICK
+                log.info('Unsuccessful Bell-state measurement: a detector did not work', at=self.proto)
+                return self._herald(BSAProtocol.FAILURE)
 
             mem = self.proto.node.qmemory
             mem.operate(ns.CNOT, [0, 1])
             mem.operate(ns.H, 0)
             [mX, mZ], _ = mem.measure([0, 1])
             if mZ == 0:
-                log.info(f'Unsuccessful Bell-state measurement: undistinguishable state', at=self.proto)
-                self._announce(BSAProtocol.FAILURE)
+                log.info('Unsuccessful Bell-state measurement: undistinguishable state', at=self.proto)
+                return self._herald(BSAProtocol.FAILURE)
             else:
                 id = etgmid('link')
-                log.info(f'Successful Bell-state measurement, assigned id: {id}', at=self.proto)
-                self._announce(
+                log.info('Successful Bell-state measurement, assigned id: %s', id, at=self.proto)
+                return self._herald(
                     BSAProtocol.SUCCESS,
                     dict(id=id, cX=mZ==1, cZ=mX==1),
                     dict(id=id, cX=False, cZ=False)
                 )
-            return BSAState.WAITING_TICK
 
-    def _announce(self, result, A=None, B=None):
+    def _herald(self, result, A=None, B=None):
+        self._heralds.append((result, A, B))
+        if len(self._heralds) < self.proto.modes:
+            return BSAState.WAITING_OFFSET
+        self._announce()
+        return BSAState.WAITING_TICK
+
+    def _announce(self):
         cportA = self.proto.node.ports['coutA']
         cportB = self.proto.node.ports['coutB']
-        msgA = [result, A] if A else [result]
-        msgB = [result, B] if B else [result]
-
-        cportA.tx_output(Message(msgA, header=PhysicalLayer.MSG_HEADER))
-        log.info(f'To A: {log.msg2str(msgA)}', outof=self.proto)
-        cportB.tx_output(Message(msgB, header=PhysicalLayer.MSG_HEADER))
-        log.info(f'To B: {log.msg2str(msgB)}', outof=self.proto)
+        slotsA = [[result, A] if A else [result] for result, A, _ in self._heralds]
+        slotsB = [[result, B] if B else [result] for result, _, B in self._heralds]
+        # a single mode keeps the plain [result, data] message
+        msgA = slotsA if self.proto.modes > 1 else slotsA[0]
+        msgB = slotsB if self.proto.modes > 1 else slotsB[0]
+
+        cportA.tx_output(Message(msgA, header=PhysicalLayer.MSG_HEADER, tick=self._tick))
+        log.info(lambda: f"To A: {', '.join(map(log.msg2str, slotsA))}", outof=self.proto)
+        cportB.tx_output(Message(msgB, header=PhysicalLayer.MSG_HEADER, tick=self._tick))
+        log.info(lambda: f"To B: {', '.join(map(log.msg2str, slotsB))}", outof=self.proto)
@@ -23,6 +23,8 @@ class PhysicalLayer(
         self.log_layer = log.Layer.PHYSICAL
         super().__init__(node, name)
         self.add_signal(PhysicalLayer.ATTEMPTED_EG)
+        self.modes = 1
+        self.pipeline_depth = 1
 
     def create_statemachine(self):
         return PhysicalLayerStatemachine(self)
@@ -31,11 +33,14 @@ class PhysicalLayer(
     def _attempt_entanglement(self, req):
         pass
 
-    def attempt_entanglement(self, position, **kwargs):
+    def attempt_entanglement(self, *positions, **kwargs):
+        # multiplexed layers attempt every position, one per mode
         return self._push_request(
             PhysicalLayer.ATTEMPT_EG,
             PhysicalLayer.ATTEMPTED_EG,
-            position=position,
+            position=positions[0],
+            positions=list(positions),
+            cancelled=False,
             **kwargs
         )
 
@@ -13,54 +13,123 @@ from components.hardware import program_function, ProgramPriority
 
 
 class SwapWithBSAProtocol (PhysicalLayer):
-    def __init__(self, node, clock, qport, cport, collection_eff=1, qfc_eff=1, name=None) -> None:
+    def __init__(self, node, clock, qport, cport, collection_eff=1, qfc_eff=1,
+        modes=1, mode_spacing=0, pipeline_depth=1, emission_delay=0,
+        lazy_emission=False, transmittance=1, detector_efficiency=1,
+        seed=None, name=None
+    ) -> None:
         super().__init__(node, name)
         self.clock = clock
         self.qport_name = qport
         self.cport_name = cport
         self.coll_eff = collection_eff
         self.qfc_eff = qfc_eff
+        self.modes = modes
+        self.mode_spacing = mode_spacing
+        self.pipeline_depth = pipeline_depth
+        self.emission_delay = emission_delay
+        self.lazy_emission = lazy_emission
+        self.transmittance = transmittance
+        self.detector_eff = detector_efficiency
+        # without an explicit seed the stream is drawn from the global
+        # generator, so np.random.seed still reproduces a whole network
+        self.rng = np.random.default_rng(
+            seed if seed is not None else np.random.randint(2**32))
+        self._in_flight = dict()
+        if pipeline_depth > 1:
+            self.add_subprotocol(_HeraldListener(node, self), name='herald_listener')
+            self.add_subprotocol(_HeraldResolver(node, self), name='herald_resolver')
+
+    def run(self):
+        self.start_subprotocols()
+        yield from super().run()
 
     def _attempt_entanglement(self, req):
         qout = self.node.ports[self.qport_name]
-        cin = self.node.ports[self.cport_name]
         mem = self.node.qmemory
+        if req.cancelled:
+            return
 
+        self.clock.request_tick()
         yield self.await_signal(
             sender=self.clock,
             signal_label=Clock.TICK
         )
+        tick = ns.sim_time()
+        index = self.clock.tick_index()
+
+        # temporal multiplexing, one photon per time bin of the period
+        for mode, pos in enumerate(req.positions):
+            delay = tick + mode * self.mode_spacing - ns.sim_time()
+            if delay > 0:
+                yield self.await_timer(delay)
+            if self.lazy_emission and not self._will_arrive():
+                log.info('Photon would be lost, emission skipped', at=self)
+                continue
+            yield from self.prepare_bell_state([pos, mem.photon_pos()])
+            # a pipelined BSA places photons by arrival time, one that left
+            # late would be judged with another tick
+            late = ns.sim_time() - (tick + mode * self.mode_spacing + self.emission_delay)
+            if self.pipeline_depth > 1 and late > 1e-6:
+                log.info('Photon emission %s ns late, dropped', late, at=self)
+                continue
+            self._emit_photon(qout, mem)
+
+        if self.pipeline_depth > 1:
+            # the herald is matched to the attempt by its tick index later
+            self._in_flight[index] = (req, req.positions)
+            return
+        yield from self._await_herald(req, req.positions)
+
+    def _will_arrive(self):
+        # the whole loss budget up to this side's detector, drawn at once
+        [coll, qfc, fibre, det] = self.rng.random(4)
+        return (
+            coll <= self.coll_eff and qfc <= self.qfc_eff
+            and fibre <= self.transmittance and det <= self.detector_eff
+        )
 
-        qubits = [pos, _] = [req.position, mem.photon_pos()]
-        yield from self.prepare_bell_state(qubits)
+    def _emit_photon(self, qout, mem):
+        if not self.lazy_emission:
+            [coll, qfc] = self.rng.random(2)
+            if coll > self.coll_eff:
+                log.info('Collection of photon failed', at=self)
+                return
+            elif qfc > self.qfc_eff:
+                log.info('Frequency conversion failed', at=self)
+                return
+        [photon] = mem.pop_photon()
+        qout.tx_output(photon)
+        log.info('Sent photon', outof=self)
 
-        [coll, qfc] = np.random.rand(2)
-        if coll > self.coll_eff:
-            log.info(f'Collection of photon failed', at=self)
-        elif qfc > self.qfc_eff:
-            log.info(f'Frequency conversion failed', at=self)
-        else:
-            [photon] = mem.pop_photon()
-            qout.tx_output(photon)
-            log.info(f'Sent photon', outof=self)
+    def _await_herald(self, req, positions, attempts=1):
+        cin = self.node.ports[self.cport_name]
 
         yield self.await_port_input(cin)
         msg = cin.rx_input(header=PhysicalLayer.MSG_HEADER)
         if not msg: return
-        
-        log.info(f'Received: {log.msg2str(msg.items)}', into=self)
-        result = msg.items[0]
-        if result == BSAProtocol.SUCCESS:
-            data = msg.items[1]
-            yield from self.execute_correction([pos], cX=data['cX'], cZ=data['cZ'])
-            [q] = self.node.qmemory.peek(pos)
-            correct = KetRepr(ket=ketstates.b00)
-            fidelity = q.qstate.qrepr.fidelity(correct)
-            req.answare(result=PhysicalLayer.SUCCESS, position=pos, etgm_id=data['id'])
-            log.info(f'Entanglement swapping successful, fidelity: {fidelity}', at=self)
-        else:
-            req.answare(result=PhysicalLayer.FAILURE)
-            log.info(f'Entanglement swapping failed', into=self)
+        yield from self._resolve(req, positions, self._heralds(msg), attempts)
+
+    def _heralds(self, msg):
+        # a multiplexed BSA answers with one herald slot per mode
+        heralds = msg.items if self.modes > 1 else [msg.items]
+        log.info(lambda: f"Received: {', '.join(map(log.msg2str, heralds))}", into=self)
+        return heralds
+
+    def _resolve(self, req, positions, heralds, attempts=1):
+        for pos, herald in zip(positions, heralds):
+            if herald[0] == BSAProtocol.SUCCESS:
+                data = herald[1]
+                yield from self.execute_correction([pos], cX=data['cX'], cZ=data['cZ'])
+                [q] = self.node.qmemory.peek(pos)
+                correct = KetRepr(ket=ketstates.b00)
+                fidelity = q.qstate.qrepr.fidelity(correct)
+                req.answare(result=PhysicalLayer.SUCCESS, position=pos, etgm_id=data['id'], attempts=attempts)
+                log.info('Entanglement swapping successful, fidelity: %s', fidelity, at=self)
+                return
+
+        req.answare(result=PhysicalLayer.FAILURE, attempts=attempts)
+        log.info('Entanglement swapping failed', into=self)
             
     @program_function(2, ProgramPriority.REAL_TIME, 'phys')
     def prepare_bell_state(self, prog, qubits):
@@ -75,3 +144,41 @@ class SwapWithBSAProtocol (PhysicalLayer):
         [q] = qubits
         if cX: prog.apply(INSTR_X, q)
         if cZ: prog.apply(INSTR_Z, q)
+
+
+class _HeraldListener (NodeProtocol):
+    def __init__(self, node, phys_protocol, name=None):
+        super().__init__(node, name)
+        self.phys_proto = phys_protocol
+
+    def run(self):
+        phys = self.phys_proto
+        cin = self.node.ports[phys.cport_name]
+        while True:
+            # never blocks on anything but the port, so no herald is missed
+            yield self.await_port_input(cin)
+            msg = cin.rx_input(header=PhysicalLayer.MSG_HEADER)
+            if not msg:
+                continue
+            attempt = phys._in_flight.pop(msg.meta.get('tick'), None)
+            if attempt is None:
+                continue
+            req, positions = attempt
+            phys.subprotocols['herald_resolver'].resolve(req, positions, phys._heralds(msg))
+
+
+class _HeraldResolver (QueuedProtocol):
+    def __init__(self, node, phys_protocol, name=None):
+        super().__init__(node, name)
+        self.phys_proto = phys_protocol
+
+    def run(self):
+        while True:
+            yield from self._await_request()
+            for req in self._poll_requests():
+                if req.attempt.cancelled:
+                    continue
+                yield from self.phys_proto._resolve(req.attempt, req.positions, req.heralds)
+
+    def resolve(self, attempt, positions, heralds):
+        self._push_request(None, None, attempt=attempt, positions=positions, heralds=heralds)
@@ -8,6 +8,7 @@ from netsquid.components.component import Message
 
 from components.hardware.nvcprocessor import program_function, ProgramPriority
 from ..util import *
+from .. import bell_diagonal as bd
 
 
 class _RecordType(Enum):
@@ -72,7 +73,7 @@ class DEJMPSProtocol (NodeProtocol):
             else:
                 msg = self.cport.rx_input(header=self.MSG_HEADER)
                 if not msg: continue
-                log.info(log.msg2str(msg.items), into=self)
+                log.info(log.msg2str, msg.items, into=self)
                 [msg_type, data] = msg.items
                 if msg_type == DEJMPSProtocol.ITER_MSG:
                     id1 = data['qubit1']
@@ -103,7 +104,7 @@ class DEJMPSProtocol (NodeProtocol):
         self.records.clear()
 
     def _announce(self, req, keep, id1, id2):
-        log.info(f'Iteration result: {keep}, {id1} -X {id2}', at=self)
+        log.info('Iteration result: %s, %s -X %s', keep, id1, id2, at=self)
         req.answare(
             keep=keep,
             qubit1=id1,
@@ -125,9 +126,12 @@ class _PurificationMinion (QueuedProtocol):
         while True:
             yield from self._await_request()
             for req in self._poll_requests():
-                log.info(f'Purifying qubits: {req.q1.id} -X {req.q2.id}', at=self.dejmps)
+                log.info('Purifying qubits: %s -X %s', req.q1.id, req.q2.id, at=self.dejmps)
                 output = yield from self.perform_purification([req.q1.position, req.q2.position])
                 [result] = output['m']
+                compact_result = bd.purify_pairs(self.node.qmemory, req.q1.position, req.q2.position)
+                if compact_result is not None:
+                    result = compact_result
 
                 msg = [
                     DEJMPSProtocol.ITER_MSG,
@@ -140,7 +144,7 @@ class _PurificationMinion (QueuedProtocol):
                 self.dejmps.cport.tx_output(Message(msg,
                     header=self.dejmps.MSG_HEADER
                 ))
-                log.info(log.msg2str(msg), outof=self.dejmps)
+                log.info(log.msg2str, msg, outof=self.dejmps)
                 self.send_signal(
                     _PurificationMinion.MEASUREMENT_COMPLETED,
                     _PurificationRecord(_RecordType.MEASURED, req.q1.id, req.q2.id, result, req.master_req)
@@ -19,21 +19,21 @@ class GreedyPurify(PurificationProtocol):
         self.current_iters += 1
         if self.current_iters == 1:
             self.current = qubit
-            log.info(f'Purifying {qubit.id}', at=self)
+            log.info('Purifying %s', qubit.id, at=self)
         else:
             resp = yield from (self.dejmps
                 .purify(self.current, qubit)
                 .await_as(self))
             self.node.qmemory.deallocate([qubit.position])
             if resp.keep:
-                log.info(f'Iteration #{self.current_iters-1} successful: o -X {qubit.id}', at=self)
+                log.info('Iteration #%s successful: o -X %s', self.current_iters-1, qubit.id, at=self)
                 if self.current_iters > self.iterations:
-                    log.info(f'Purification complete: {self.current.id}', at=self)
+                    log.info('Purification complete: %s', self.current.id, at=self)
                     self.deliver_pair(self.current)
                     self.current = None
                     self.handle_reset()
             else:
-                log.info(f'Iteration #{self.current_iters-1} failed: o -X {qubit.id}', at=self)
+                log.info('Iteration #%s failed: o -X %s', self.current_iters-1, qubit.id, at=self)
                 self.handle_reset()
 
 
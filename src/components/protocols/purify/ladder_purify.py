@@ -31,7 +31,7 @@ class LadderPurify(PurificationProtocol):
             if resp.keep:
                 id1 = self.ladder[j].id
                 id2 = self.ladder[j-1].id
-                log.info(f'Successful iteration #{j}: {id1} -X {id2}', at=self)
+                log.info('Successful iteration #%s: %s -X %s', j, id1, id2, at=self)
             self._drop_qubit(j-1)
 
             if resp.keep and self.ladder[j+1] is None:
@@ -44,7 +44,7 @@ class LadderPurify(PurificationProtocol):
 
         if self.ladder[self.iterations+1] is not None:
             id = self.ladder[self.iterations+1].id
-            log.info(f'Purification complete: {id}', at=self)
+            log.info('Purification complete: %s', id, at=self)
             self.deliver_pair(self.ladder[self.iterations+1])
             self.ladder[self.iterations+1] = None
             self.handle_reset()
@@ -33,7 +33,7 @@ class PurificationProtocol (QueuedProtocol):
                     if self.iterations == 0:
                         self.deliver_pair(req.qubit)
                     elif len(self._queue) > self.queue_limit:
-                        log.info(f'Queue limit exceeded, dropping qubit {req.qubit.id}', at=self)
+                        log.info('Queue limit exceeded, dropping qubit %s', req.qubit.id, at=self)
                         self.node.qmemory.deallocate([req.qubit.position])
                     else:
                         yield from self.handle_pair(req.qubit)
@@ -65,7 +65,7 @@ class TeleportProtocol (TransportLayer):
                 trans_msg = self.cport.rx_input(header=TransportLayer.MSG_HEADER)
                 if not trans_msg:
                     continue
-                log.info(log.msg2str(trans_msg.items), into=self)
+                log.info(log.msg2str, trans_msg.items, into=self)
                 data = trans_msg.items[1]
                 id = data['id']
                 self.minion.correct(qubits[id], data['cX'], data['cZ'], req)
@@ -115,7 +115,7 @@ class _TeleportMinion (QueuedProtocol):
                         trans_msg,
                         header=TransportLayer.MSG_HEADER
                     ))
-                    log.info(log.msg2str(trans_msg), outof=self.proto)
+                    log.info(log.msg2str, trans_msg, outof=self.proto)
                 elif req.req_label == _TeleportMinion.CORRECT_REQ:
                     if req.cX or req.cZ:
                         yield from self._correct([req.position], req.cX, req.cZ)
@@ -1,9 +1,11 @@
 
 import inspect
+import math
 from collections import deque, namedtuple
 from enum import Enum
 import netsquid as ns
 from netsquid.protocols import LocalProtocol, NodeProtocol
+from netsquid.components.component import Message
 from abc import ABCMeta as Abstract, abstractmethod
 from shortuuid import uuid
 
@@ -78,12 +80,60 @@ class QueuedProtocol (NodeProtocol):
         return req
     
 
+class MessageBatcher (NodeProtocol):
+    _ITEMS_ADDED = 'MessageBatcher.ITEMS_ADDED'
+
+    def __init__(self, node, port, window=0, max_messages=None, name=None):
+        super().__init__(node, name)
+        self.add_signal(MessageBatcher._ITEMS_ADDED)
+        self.port = port
+        self.window = window
+        self.max_messages = max_messages
+        self._batches = dict()
+
+    def run(self):
+        while True:
+            yield self.await_signal(
+                sender=self,
+                signal_label=MessageBatcher._ITEMS_ADDED
+            )
+            # a zero window still packs everything sent at the same instant
+            yield self.await_timer(self.window)
+            self.flush()
+
+    def send(self, items, header):
+        # no size limit (None or 0) batches by the window alone, without
+        # a window or with single message batches there is nothing to wait for
+        if self.max_messages == 1 or (not self.max_messages and self.window <= 0):
+            self.port.tx_output(Message(items, header=header))
+            return
+
+        if header not in self._batches:
+            self._batches[header] = []
+            self.send_signal(MessageBatcher._ITEMS_ADDED)
+        batch = self._batches[header]
+        batch.append(items)
+        if self.max_messages and len(batch) >= self.max_messages:
+            self.flush(header)
+
+    def flush(self, header=None):
+        headers = list(self._batches) if header is None else [header]
+        for header in headers:
+            if header in self._batches:
+                batch = self._batches.pop(header)
+                self.port.tx_output(Message(
+                    [item for items in batch for item in items],
+                    header=header
+                ))
+
+
 class ProtocolRequest:
     def __init__(self, protocol, req_label, ans_label, **kwargs):
         self.proto = protocol
         self.id = uuid()
         self.req_label = req_label
         self.ans_label = ans_label
+        self.response = None
         for name, value in kwargs.items():
             setattr(self, name, value)
         
@@ -96,6 +146,8 @@ class ProtocolRequest:
             
     def answare(self, **kwargs):
         resp = ProtocolResponse(self.id, **kwargs)
+        # kept on the request as well, signals only hold the latest answer
+        self.response = resp
         self.proto.send_signal(self.ans_label, resp)
 
     def resp_event(self, awaiting_protocol):
@@ -205,7 +257,7 @@ class ProtocolStateMachine:
             if self._final_states and self._state in self._final_states:
                 raise RuntimeError(f'Cannot change state from final state {self._state}')
             self._state = state
-            log.info(f'State change -> {state.value}', at=self.proto)
+            log.info('State change -> %s', state.value, at=self.proto)
     
     def get_state(self):
         return self._state
@@ -236,23 +288,55 @@ class ProtocolStateMachine:
 
 class Clock (LocalProtocol):
     TICK = 'tick'
+    _DEMAND = 'Clock.DEMAND'
 
-    def __init__(self, delta_time, nodes=None, name=None):
+    def __init__(self, delta_time, nodes=None, on_demand=False, name=None):
         super().__init__(name=name)
         self._delta_time = delta_time
         self._tick_count = 0
+        self.on_demand = on_demand
+        self._pending = 0
+        self._suspended = False
+        self._start = 0
         self.add_signal(Clock.TICK)
-        for node in nodes:
+        self.add_signal(Clock._DEMAND)
+        for node in nodes or []:
             self.nodes[node.name] = node
 
     def run(self):
+        self._start = ns.sim_time()
         while True:
+            if self.on_demand and not self._pending:
+                self._suspended = True
+                yield self.await_signal(sender=self, signal_label=Clock._DEMAND)
+                self._suspended = False
+                # resume on the phase the clock would have had if it kept ticking
+                delay = self.next_tick() - ns.sim_time()
+                if delay > 0:
+                    yield self.await_timer(delay)
+            self._pending = 0
             self._tick_count += 1
             self.send_signal(Clock.TICK)
-            node_names = ','.join(self.nodes.keys())
-            log.info(f'TICK for {node_names}', at=self)
+            log.info(lambda: f"TICK for {','.join(self.nodes.keys())}", at=self)
             yield self.await_timer(self._delta_time)
 
+    def request_tick(self):
+        # called before awaiting TICK, an on demand clock only ticks when requested
+        self._pending += 1
+        if self._suspended:
+            self._suspended = False
+            self.send_signal(Clock._DEMAND)
+
+    def next_tick(self):
+        elapsed = ns.sim_time() - self._start
+        periods = math.ceil(elapsed / self._delta_time - 1e-9)
+        return self._start + periods * self._delta_time
+
+    def tick_index(self, time=None):
+        if time is None:
+            time = ns.sim_time()
+        return round((time - self._start) / self._delta_time)
+
     def delta_time(self):
         return self._delta_time
     
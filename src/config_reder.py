@@ -2,6 +2,7 @@
 import yaml
 import re
 import io
+import copy
 from netsquid.util.simtools import \
     MICROSECOND, MILLISECOND, SECOND, NANOSECOND
 
@@ -15,6 +16,16 @@ class ConfigHolder:
             else:
                 setattr(self, key, value)
 
+    def override(self, values):
+        config = copy.deepcopy(self)
+        for path, value in values.items():
+            *parents, name = path.split('.')
+            holder = config
+            for parent in parents:
+                holder = getattr(holder, parent)
+            setattr(holder, name, _translate_value(value))
+        return config
+
     def __str__(self):
         with io.StringIO() as strio:
             for key, value in self.__dict__.items():
@@ -46,17 +57,22 @@ def _transalte_unit(value, unit):
         return _translate_time(value, unit[:-1])
 
 
+def _translate_value(value):
+    if isinstance(value, str):
+        matched = re.match(r"(\d+\.?\d*)(\D+)", value)
+        return _transalte_unit(
+            matched.group(1),
+            matched.group(2)
+        )
+    return value
+
+
 def _transalte_units(config):
     for key, value in config.items():
         if isinstance(value, dict):
             _transalte_units(value)
         else:
-            if isinstance(value, str):
-                matched = re.match(r"(\d+\.?\d*)(\D+)", value)
-                config[key] = _transalte_unit(
-                    matched.group(1),
-                    matched.group(2)
-                )
+            config[key] = _translate_value(value)
 
 
 def read_config(file_name):
@@ -6,10 +6,12 @@ from netsquid.util.simtools import MICROSECOND, MILLISECOND, SECOND, NANOSECOND
 from simlog import log
 from components.hardware import NVCProcessor, QuantumFibre, ClassicalFibre
 from components.protocols.phys import BSAProtocol, SwapWithBSAProtocol, PhysicalLayer
+from components.protocols.phys import SampledBSAProtocol, SampledSwapWithBSAProtocol
 from components.protocols.util import *
 from components.nodes import BSANode
 from components.protocols.net import SwapWithRepeaterProtocol, RepeaterProtocol, ForwardProtocol
 from components.protocols.link import SimPLE, LinkResponseType, LinkDescriptor, StateInsertionProtocol, LinkLayer
+from components.protocols.link import PurificationModel, PurifiedInsertionProtocol
 
 
 def create_nvc_processor(config, centre_count=1, name=None):
@@ -22,26 +24,30 @@ def create_nvc_processor(config, centre_count=1, name=None):
         T1=mem.T1, T2=mem.T2, num_in_centre=mem.num_in_centre,
         t_gate=mem.t_gate, t_CX=multi.t_CX, t_init=mem.t_init, t_readout=mem.t_readout,
         F_gate=mem.F_gate, F_CX=multi.F_CX, F_init=mem.F_init, F_readout=mem.F_readout,
-        centre_count=centre_count, F_iCX=inter.F_CX, t_iCX=inter.t_CX, name=name
+        centre_count=centre_count, F_iCX=inter.F_CX, t_iCX=inter.t_CX,
+        fuse_programs=getattr(proc, 'fuse_programs', False), name=name
     )
 
 
-def create_qfibre(config, length, name=None):
+def create_qfibre(config, length, name=None, lossless=False, one_way=False):
     fibre = config.fibre
     return QuantumFibre(
         length=length,
         attenuation=fibre.attenuation,
         refractive_index=fibre.index_of_refraction,
         depolarizing_coeff=fibre.depolarization_length,
+        lossless=lossless,
+        one_way=one_way,
         name=name
     )
 
 
-def create_cfibre(config, length, name=None):
+def create_cfibre(config, length, name=None, one_way=False):
     fibre = config.fibre
     return ClassicalFibre(
         length=length,
         refractive_index=fibre.index_of_refraction,
+        one_way=one_way,
         name=name
     )
 
@@ -83,83 +89,133 @@ def create_repeater_nodes(config, net, count, multi_centre=False):
     return reps
 
 
-def create_physical_link(config, dst, net, alice, bob):
+def create_physical_link(
+    config, dst, net, alice, bob,
+    on_demand_clock=False, sampled_bsa=False,
+    modes=1, pipeline_depth=1, lazy_emission=False
+):
     bsa = BSANode(name='BSA')
     net.add_node(bsa)
 
     roundtrip = dst*1.45/3e5
-    clk = (roundtrip) * SECOND + 8*MICROSECOND
     travel = roundtrip * SECOND / 2
     fiber = dst / 2
 
-    clock = Clock(delta_time=clk, nodes=[alice, bob, bsa])
+    # photons leave once the bell state is prepared, temporal modes are
+    # emitted one preparation apart
+    mem = config.node.processor.memory_qubits
+    emission_delay = mem.t_init + mem.t_gate
+    mode_spacing = max(emission_delay, NANOSECOND)
+    clk = (roundtrip) * SECOND + 8*MICROSECOND + (modes - 1) * mode_spacing
+    if modes > 1:
+        detection_offset = travel + emission_delay - mode_spacing / 2
+        detection_window = mode_spacing
+    else:
+        detection_offset = travel*0.9
+        detection_window = travel*0.2
+
+    pipelined = pipeline_depth > 1 and not sampled_bsa
+    if pipelined:
+        # tick as fast as the processor can prepare every mode and the
+        # detection windows fit, the photons of a tick then arrive exactly
+        # a whole number of ticks later
+        detection_window = min(detection_window, 8*MICROSECOND)
+        detection_offset = travel + emission_delay - detection_window / 2
+        period = max(
+            modes * mode_spacing,
+            detection_window + (modes - 1) * mode_spacing
+        ) + 8*MICROSECOND
+        ticks = int(detection_offset // period)
+        if ticks > 0:
+            clk = detection_offset / ticks
+
+    # a pipelined BSA has photons in flight while no attempt is queued
+    clock = Clock(
+        delta_time=clk, nodes=[alice, bob, bsa],
+        on_demand=(on_demand_clock or sampled_bsa) and not pipelined
+    )
 
-    qA2BSA = create_qfibre(config, fiber, 'Alc-BSA_q')
-    qB2BSA = create_qfibre(config, fiber, 'Bob-BSA_q')
+    # photons only travel to the BSA and heralds only travel back
+    qA2BSA = create_qfibre(config, fiber, 'Alc-BSA_q', lossless=lazy_emission, one_way=True)
+    qB2BSA = create_qfibre(config, fiber, 'Bob-BSA_q', lossless=lazy_emission, one_way=True)
 
-    cA2BSA = create_cfibre(config, fiber, 'Alc-BSA_c')
-    cB2BSA = create_cfibre(config, fiber, 'Bob-BSA_c')
+    cBSA2A = create_cfibre(config, fiber, 'Alc-BSA_c', one_way=True)
+    cBSA2B = create_cfibre(config, fiber, 'Bob-BSA_c', one_way=True)
 
-    # TODO use connect_nodes
-    net.add_connection(
-        alice, bsa, qA2BSA,
-        label='Alice-BSA_quantum',
-        port_name_node1='qout', port_name_node2='qinA'
-    )
-    net.add_connection(
-        alice, bsa, cA2BSA,
-        label='Alice-BSA_classical',
-        port_name_node1='cin', port_name_node2='coutA'
-    )
-    net.add_connection(
-        bob, bsa, qB2BSA,
-        label='Bob-BSA_quantum',
-        port_name_node1='qout', port_name_node2='qinB'
-    )
-    net.add_connection(
-        bob, bsa, cB2BSA,
-        label='Bob-BSA_classical',
-        port_name_node1='cin', port_name_node2='coutB'
-    )
+    connect_nodes(net, alice, 'qout', bsa, 'qinA', qA2BSA, 'Alice-BSA_quantum')
+    connect_nodes(net, bsa, 'coutA', alice, 'cin', cBSA2A, 'Alice-BSA_classical')
+    connect_nodes(net, bob, 'qout', bsa, 'qinB', qB2BSA, 'Bob-BSA_quantum')
+    connect_nodes(net, bsa, 'coutB', bob, 'cin', cBSA2B, 'Bob-BSA_classical')
 
-    alice_phys = SwapWithBSAProtocol(
-        alice, clock, 'qout', 'cin',
-        collection_eff=config.node.processor.communication_qubit.photon_collection,
-        qfc_eff=config.node.qfc.efficiency,
-        name='AlcPHYS'
-    )
-    alice_link = SimPLE(alice, alice_phys, name='AlcLINK')
+    comm = config.node.processor.communication_qubit
+    if sampled_bsa:
+        # loss and detection are sampled in batches, only heralded ticks run
+        engine = SampledBSAProtocol(bsa, clock, fiber,
+            attenuation=config.fibre.attenuation,
+            depolarizing_coeff=config.fibre.depolarization_length,
+            refractive_index=config.fibre.index_of_refraction,
+            detector_efficiency=config.bsa.SPD_efficiency,
+            name='BSAENG'
+        )
+        alice_phys = SampledSwapWithBSAProtocol(
+            alice, engine, 'A', 'cin',
+            collection_eff=comm.photon_collection,
+            qfc_eff=config.node.qfc.efficiency,
+            name='AlcPHYS'
+        )
+        bob_phys = SampledSwapWithBSAProtocol(
+            bob, engine, 'B', 'cin',
+            collection_eff=comm.photon_collection,
+            qfc_eff=config.node.qfc.efficiency,
+            name='BobPHYS'
+        )
+        engine.start()
+    else:
+        alice_phys = SwapWithBSAProtocol(
+            alice, clock, 'qout', 'cin',
+            collection_eff=comm.photon_collection,
+            qfc_eff=config.node.qfc.efficiency,
+            modes=modes, mode_spacing=mode_spacing,
+            pipeline_depth=pipeline_depth, emission_delay=emission_delay,
+            lazy_emission=lazy_emission,
+            transmittance=qA2BSA.transmittance(),
+            detector_efficiency=config.bsa.SPD_efficiency,
+            name='AlcPHYS'
+        )
+        bob_phys = SwapWithBSAProtocol(
+            bob, clock, 'qout', 'cin',
+            collection_eff=comm.photon_collection,
+            qfc_eff=config.node.qfc.efficiency,
+            modes=modes, mode_spacing=mode_spacing,
+            pipeline_depth=pipeline_depth, emission_delay=emission_delay,
+            lazy_emission=lazy_emission,
+            transmittance=qB2BSA.transmittance(),
+            detector_efficiency=config.bsa.SPD_efficiency,
+            name='BobPHYS'
+        )
+        bsa_phys = BSAProtocol(bsa, clock,
+            detection_offset=detection_offset,
+            detection_window=detection_window,
+            # lazy emitters already drew their own detector
+            detector_efficiency=1 if lazy_emission else config.bsa.SPD_efficiency,
+            modes=modes, mode_spacing=mode_spacing
+        )
+        bsa_phys.start()
+    clock.start()
 
-    bob_phys = SwapWithBSAProtocol(
-        bob, clock, 'qout', 'cin',
-        collection_eff=config.node.processor.communication_qubit.photon_collection,
-        qfc_eff=config.node.qfc.efficiency,
-        name='BobPHYS'
-    )
+    alice_link = SimPLE(alice, alice_phys, name='AlcLINK')
     bob_link = SimPLE(bob, bob_phys, name='BobLINK')
 
-    bsa_phys = BSAProtocol(bsa, clock,
-        detection_offset=travel*0.9,
-        detection_window=travel*0.2,
-        detector_efficiency=config.bsa.SPD_efficiency
-    )
-    bsa_phys.start()
-    clock.start()
-
     return alice_link, bob_link
 
 
-def create_link_with_insertion(
-    config, dst, net, alice, bob, 
-    part_alice=None, part_bob=None
-):
+def link_descriptor_params(config):
     comm = config.node.processor.communication_qubit
     qfc = config.node.qfc
     fibre = config.fibre
     bsa = config.bsa
 
-    link_desc = LinkDescriptor(
-        distance=dst,
+    return dict(
         qfc_eff=qfc.efficiency,
         collection_eff=comm.photon_collection,
         detection_eff=bsa.SPD_efficiency,
@@ -172,8 +228,22 @@ def create_link_with_insertion(
         refractive_index=fibre.index_of_refraction
     )
 
+
+def prepare_link_descriptors(config, distances):
+    return LinkDescriptor.grid(distances, **link_descriptor_params(config))
+
+
+def create_link_with_insertion(
+    config, dst, net, alice, bob, 
+    part_alice=None, part_bob=None,
+    fast_forward=False, compact=False
+):
+    link_desc = LinkDescriptor.cached(dst, **link_descriptor_params(config))
+
     common_link = StateInsertionProtocol(
         alice, bob, link_desc,
+        fast_forward=fast_forward,
+        compact=compact,
         name=f'{alice.name}{bob.name}INS'
     )
     alice_link, bob_link = common_link.node_protocols(part_alice, part_bob)
@@ -182,12 +252,45 @@ def create_link_with_insertion(
     return alice_link, bob_link
 
 
+def create_purified_link_with_insertion(
+    config, dst, net, alice, bob,
+    ladder_iter=1, greedy_iter=1,
+    part_alice=None, part_bob=None,
+    fast_forward=False, compact=False
+):
+    mem = config.node.processor.memory_qubits
+    multi = config.node.processor.multiqubit_gates
+
+    model = PurificationModel(
+        LinkDescriptor.cached(dst, **link_descriptor_params(config)),
+        ladder_iter, greedy_iter,
+        distance=dst,
+        refractive_index=config.fibre.index_of_refraction,
+        t_gate=mem.t_gate, t_CX=multi.t_CX, t_readout=mem.t_readout,
+        F_gate=mem.F_gate, F_CX=multi.F_CX, F_readout=mem.F_readout
+    )
+
+    common_link = PurifiedInsertionProtocol(
+        alice, bob, model,
+        fast_forward=fast_forward,
+        compact=compact,
+        name=f'{alice.name}{bob.name}PINS'
+    )
+    alice_link, bob_link = common_link.node_protocols(part_alice, part_bob)
+    common_link.start()
+
+    return alice_link, bob_link
+
+
 def connect_with_rep_chain(
     config, net, alice, bob, dst, count,
     app_headers=None, multi_centre=False,
     reserve_on_nodes=0,
     link_setup=lambda n1,l1,p1,n2,l2,p2: (l1,l2),
-    net_cutoff = 10*SECOND
+    net_cutoff = 10*SECOND,
+    fast_forward=False, compact=False,
+    batch_window=0, batch_size=None,
+    create_link=create_link_with_insertion
 ):
     if count < 1:
         raise ValueError('There must be 1 repeater in the network')
@@ -216,14 +319,18 @@ def connect_with_rep_chain(
         rep_partA = whole_part[:half]
         rep_partB = whole_part[half:]
 
-    alice_link, repA = create_link_with_insertion(
+    alice_link, repA = create_link(
         config, node_dst, net, alice, reps[0],
-        part_alice=partA, part_bob=rep_partA
+        part_alice=partA, part_bob=rep_partA,
+        fast_forward=fast_forward,
+        compact=compact
     )
     alice_link, repA = link_setup(alice, alice_link, 'cdir', reps[0], repA, 'cA')
-    repB, bob_link = create_link_with_insertion(
+    repB, bob_link = create_link(
         config, node_dst, net, reps[-1], bob,
-        part_alice=rep_partB, part_bob=partB
+        part_alice=rep_partB, part_bob=partB,
+        fast_forward=fast_forward,
+        compact=compact
     )
     repB, bob_link = link_setup(reps[-1], repB, 'cB', bob, bob_link, 'cdir')
     if count > 1:
@@ -238,9 +345,11 @@ def connect_with_rep_chain(
             net, rep1, 'cB', rep2, 'cA',
             create_cfibre(config, node_dst, f'{rep1.name}{rep2.name}')
         )
-        repl1, repl2 = create_link_with_insertion(
+        repl1, repl2 = create_link(
             config, node_dst, net, rep1, rep2,
-            part_alice=rep_partB, part_bob=rep_partA
+            part_alice=rep_partB, part_bob=rep_partA,
+            fast_forward=fast_forward,
+            compact=compact
         )
         repl1.name += '2'
         repl2.name += '1'
@@ -249,7 +358,11 @@ def connect_with_rep_chain(
     for rep, (linkA, linkB) in zip(reps, rep_links):
         if rep != linkA.node or rep != linkB.node:
             raise ValueError('Link node does not match repeater node')
-        RepeaterProtocol(rep, 'cA', linkA, 'cB', linkB, name=f'{rep.name}NET').start()
+        RepeaterProtocol(
+            rep, 'cA', linkA, 'cB', linkB,
+            batch_window=batch_window, batch_size=batch_size,
+            name=f'{rep.name}NET'
+        ).start()
         if app_headers is not None:
             ForwardProtocol(
                 rep, app_headers,
@@ -258,9 +371,9 @@ def connect_with_rep_chain(
             ).start()
 
     alice_net = SwapWithRepeaterProtocol(
-        alice, 'cdir', alice_link,
-        cutoff_time=net_cutoff, name=f'{alice.name}NET')
+        alice, 'cdir', alice_link, cutoff_time=net_cutoff,
+        batch_window=batch_window, batch_size=batch_size, name=f'{alice.name}NET')
     bob_net = SwapWithRepeaterProtocol(
-        bob, 'cdir', bob_link,
-        cutoff_time=net_cutoff, name=f'{bob.name}NET')
+        bob, 'cdir', bob_link, cutoff_time=net_cutoff,
+        batch_window=batch_window, batch_size=batch_size, name=f'{bob.name}NET')
     return alice_net, bob_net
@@ -140,6 +140,7 @@ def base_net(config, dst, repeaters, nl, ng, ll, lg, apppart=1):
 
 
 def export_proc(net, name):
+    timelines = dict()
     with open(f'data/{name}.json', 'w') as f:
         jsondict = {
             'simtime': ns.sim_time(),
@@ -150,14 +151,17 @@ def export_proc(net, name):
                 {
                     'name': node.name,
                     'usage': node.qmemory.usage_info,
-                    'timeline': list(node.qmemory.usage_timeline)
+                    'timeline': len(node.qmemory.usage_timeline)
                 }
             )
+            timelines.update(node.qmemory.usage_timeline.columns(f'{node.name}/'))
         json.dump(
             jsondict,
             fp=f,
             indent=2
         )
+    # the timelines themselves go next to the summary as numpy arrays
+    np.savez_compressed(f'data/{name}_timeline.npz', **timelines)
 
 def teleport(config):
     nl, ng, ll, lg = 1, 1, 1, 1
@@ -199,8 +203,8 @@ def qkd_proc(config):
     export_proc(net, 'qkd_proc')
     ns.sim_reset()
 
-def qkdsim(lock, config, seed, reps, pconf, length):
-    simulation(lock, formalism=QFormalism.KET)
+def qkdsim(config, seed, reps, pconf, length):
+    simulation(formalism=QFormalism.KET)
     np.random.seed(seed)
     (nl, ng, ll, lg) = pconf
     dst = 60
@@ -216,16 +220,14 @@ def qkdsim(lock, config, seed, reps, pconf, length):
     logger.start()
 
     ns.sim_run()
-    with lock:
-        with open(f'data/qkd/key_{reps}_{nl}-{ng}+{ll}-{lg}.json', 'a') as f:
-            print(f'''  {{
-    "key_length": {len(logger.key1)},
-    "duration": {logger.duration},
-    "key1":   "{tobin(logger.key1)}",
-    "key2":   "{tobin(logger.key2)}",
-    "errors": "{tobin(logger.key1 ^ logger.key2)}"
-  }},''', file=f)
     ns.sim_reset()
+    return dict(
+        key_length=len(logger.key1),
+        duration=float(logger.duration),
+        key1=tobin(logger.key1),
+        key2=tobin(logger.key2),
+        errors=tobin(logger.key1 ^ logger.key2)
+    )
 
 
 def repeati(it, ns):
@@ -254,22 +256,25 @@ def qkd_init():
         0, 0, 0, 1, 1
     ]
 
-    #for rep, pconf in zip(reps, pconfs):
-    #    (nl, ng, ll, lg) = pconf
-    #    with open(f'data/qkd/key_{rep}_{nl}-{ng}+{ll}-{lg}.json', 'w') as f:
-    #        print('[', file=f)
+    runs = list(repeati(zip(reps, pconfs), iters))
+    keys = {run: [] for run in runs}
+
     spawner = SimulationSpawner(qkdsim, 2)
-    spawner.run(
+    results = spawner.run(
         repeat(config),
-        np.random.randint(0, 2**32, len(reps)*10),
-        repeati(reps, iters),
-        repeati(pconfs, iters),
+        np.random.randint(0, 2**32, len(runs)),
+        [rep for rep, _ in runs],
+        [pconf for _, pconf in runs],
         repeat(50)
     )
-    for rep, pconf in zip(reps, pconfs):
+    for run, result in zip(runs, results):
+        keys[run].append(result)
+
+    for (rep, pconf), results in keys.items():
         (nl, ng, ll, lg) = pconf
-        with open(f'data/qkd/key_{rep}_{nl}-{ng}+{ll}-{lg}.json', 'a') as f:
-            print(']', file=f)
+        with open(f'data/qkd/key_{rep}_{nl}-{ng}+{ll}-{lg}.json', 'w') as f:
+            json.dump(results, f, indent=2)
+
 
 if __name__ == '__main__':
     config = read_config('netconf/testvalues')
@@ -11,8 +11,10 @@ from components.protocols.util import *
 from components.protocols.link import \
     LinkResponseType, LinkWithPurification
 from components.protocols.purify import *
+from components.protocols.bell_diagonal import pair_fidelity
 from prep_net import *
 from config_reder import *
+from sim_spawn import SweepRunner
 
 
 class PurifyStatLogger (LocalProtocol):
@@ -43,9 +45,10 @@ class PurifyStatLogger (LocalProtocol):
             [resp1, resp2] = yield from ProtocolRequest.await_all(self, req1, req2)
             self.t[i] = (ns.sim_time() - start) / SECOND
             start = ns.sim_time()
-            [q1] = self.node1.qmemory.peek([resp1.qubit.position])
-            [q2] = self.node2.qmemory.peek([resp2.qubit.position])
-            self.F[i] = ns.qubits.fidelity([q1, q2], ns.qubits.ketstates.b00, squared=True)
+            self.F[i] = pair_fidelity(
+                self.node1.qmemory, resp1.qubit.position,
+                self.node2.qmemory, resp2.qubit.position
+            )
             print(f'{i+1}/{self.rounds}: ', self.F[i])
             self.node1.qmemory.deallocate([resp1.qubit.position])
             self.node2.qmemory.deallocate([resp2.qubit.position])
@@ -57,50 +60,46 @@ class PurifyStatLogger (LocalProtocol):
         ns.sim_stop()
 
 
-def main(config):
-    rounds = 100
-    dsts = [10, 20, 30, 40]
-    max_iter = 5
-    iters = range(0, max_iter+1)
-    data = pd.DataFrame(
-        columns=
-        [f'{dst}_fidelity'for dst in dsts]
-        + [f'{dst}_frequency'for dst in dsts],
-        index = range(0, 10)
-    )
-
-    #bar = tqdm(range(len(dsts) * len(iters)))
-    for dst in tqdm(dsts):
-        iterations = 0
-        max_iters = 7 if dst < 35 else 6
-        for iterations in range(0, max_iters):
-            net, alice, bob = create_head_nodes(config, 'Quantum Network')
-            direct = create_cfibre(config, dst, 'AlcBobDIR')
-            connect_nodes(net, alice, 'cdir', bob, 'cdir', direct)
-            alice_link, bob_link = create_link_with_insertion(config, dst, net, alice, bob)
-
-            alice_purify = LadderPurify(alice, 'cdir', iterations, True, 2, log.Layer.LINK, 'AlcPUR')
-            alice_linkpurify = LinkWithPurification(
-                alice, alice_purify, alice_link, name='AlcLINKPUR')
+def ladder_link(config, dst, iterations, rounds=100):
+    net, alice, bob = create_head_nodes(config, 'Quantum Network')
+    direct = create_cfibre(config, dst, 'AlcBobDIR')
+    connect_nodes(net, alice, 'cdir', bob, 'cdir', direct)
+    alice_link, bob_link = create_link_with_insertion(config, dst, net, alice, bob)
 
-            bob_purify = LadderPurify(bob, 'cdir', iterations, False, 2, log.Layer.LINK, 'BobPUR')
-            bob_linkpurify = LinkWithPurification(
-                bob, bob_purify, bob_link, name='BobLINKPUR')
+    alice_purify = LadderPurify(alice, 'cdir', iterations, True, 2, log.Layer.LINK, 'AlcPUR')
+    alice_linkpurify = LinkWithPurification(
+        alice, alice_purify, alice_link, name='AlcLINKPUR')
 
-            logger = PurifyStatLogger(
-                alice, bob, alice_linkpurify, bob_linkpurify, rounds, f'greedy_{dst}')
-            logger.start()
+    bob_purify = LadderPurify(bob, 'cdir', iterations, False, 2, log.Layer.LINK, 'BobPUR')
+    bob_linkpurify = LinkWithPurification(
+        bob, bob_purify, bob_link, name='BobLINKPUR')
 
-            ns.sim_run()
-            ns.sim_reset()
+    logger = PurifyStatLogger(
+        alice, bob, alice_linkpurify, bob_linkpurify, rounds, f'greedy_{dst}')
+    logger.start()
+    ns.sim_run()
 
-            F_avg = np.average(logger.F)
-            f = rounds / logger.T
+    return dict(
+        fidelity=np.average(logger.F),
+        frequency=rounds / logger.T
+    )
 
-            data.loc[iterations, f'{dst}_fidelity'] = F_avg
-            data.loc[iterations, f'{dst}_frequency'] = f
 
-            print(f'Finished iteration {iterations}: {F_avg}')
+def main(config):
+    dsts = [10, 20, 30, 40]
+    points = [
+        dict(dst=dst, iterations=iterations)
+        for dst in dsts
+        for iterations in range(0, 7 if dst < 35 else 6)
+    ]
+
+    runner = SweepRunner(ladder_link, config, seed=0, cache='data/cache')
+    data = runner.run(points, rounds=100).unstack('dst')
+    data.columns = [f'{dst}_{v}' for v, dst in data.columns]
+    data = data[
+        [f'{dst}_fidelity'for dst in dsts]
+        + [f'{dst}_frequency'for dst in dsts]
+    ]
 
     data.to_csv('data/ladder3.csv', index=True)
 
@@ -111,6 +110,7 @@ def max_fidelity(config):
     df = pd.DataFrame(index=range(0, len(dsts)), columns=[
         'dst', 'F_avg', 'F_min', 'F_max', 'iters', 'f'
     ])
+    prepare_link_descriptors(config, dsts)
 
     for i, dst in enumerate(tqdm(dsts)):
         F_last = F_this = 0
@@ -1,20 +1,39 @@
-
 import os
+import sys
+import zlib
+import inspect
+import pickle
+import hashlib
+import tempfile
 import logging
+import numpy as np
+import pandas as pd
 import netsquid as ns
-from multiprocessing import Pool, Manager
+from tqdm import tqdm
+from itertools import product, repeat
+from functools import lru_cache
+from multiprocessing import Pool
 from psutil import cpu_count
-from itertools import repeat
 from netsquid.qubits.qformalism import QFormalism
 from simlog import log
 
 
-def simulation(lock, loglevel=logging.CRITICAL, formalism=QFormalism.DM):
-        with lock:
-            if not os.path.exists('log'):
-                os.makedirs('log')
-        log.init(loglevel, log.TimeUnit.MICROSECONDS)
-        ns.set_qstate_formalism(formalism)
+def simulation(loglevel=logging.CRITICAL, formalism=QFormalism.DM, trace=None, text=True):
+    os.makedirs('log', exist_ok=True)
+    if trace is not None:
+        # one trace per worker process, they would overwrite each other
+        root, ext = os.path.splitext(trace)
+        trace = f'{root}_{os.getpid()}{ext}'
+    log.init(loglevel, log.TimeUnit.MICROSECONDS, trace, text)
+    ns.set_qstate_formalism(formalism)
+
+
+def _call_task(task):
+    func, args = task
+    try:
+        return func(*args)
+    finally:
+        log.flush()
 
 
 class SimulationSpawner:
@@ -23,13 +42,158 @@ class SimulationSpawner:
         self.spare_cores = spare_cores
 
     def run(self, *args):
-        with Manager() as manager:
-            lock = manager.Lock()
-            zipargs = zip(repeat(lock), *args)
-            with Pool(cpu_count()-self.spare_cores) as pool:
-                pool.starmap(self.task, zipargs)
-
-def valami(lock, a, v):
-    with lock:
-        with open('output.txt', 'a') as f:
-            print(a, v, file=f)
+        # results come back to the parent in argument order, workers never
+        # touch the output files themselves
+        return list(self.stream(*args))
+
+    def stream(self, *args):
+        # the pool stays up until the generator is exhausted or closed
+        tasks = zip(repeat(self.task), zip(*args))
+        with Pool(cpu_count()-self.spare_cores) as pool:
+            yield from pool.imap(_call_task, tasks)
+
+
+def _run_sweep_point(task):
+    scenario, config, params, seed, point = task
+    np.random.seed(seed)
+    try:
+        result = scenario(config, **params)
+    finally:
+        ns.sim_reset()
+        log.flush()
+    return point, result
+
+
+class ResultCache:
+    def __init__(self, path, version=None):
+        self.path = path
+        self.version = version
+        os.makedirs(path, exist_ok=True)
+
+    def key(self, scenario, config, params, seed):
+        # the resolved config is hashed through its printed form, which
+        # lists every value after unit translation and overrides, the
+        # parameters after binding, so a changed default misses the cache
+        # defaults of the helpers a scenario calls are only covered through
+        # the source of its module, bump the version for edits elsewhere
+        bound = inspect.signature(scenario).bind(config, **params)
+        bound.apply_defaults()
+        arguments = [
+            (name, sorted(value.items()) if isinstance(value, dict) else value)
+            for name, value in list(bound.arguments.items())[1:]
+        ]
+        content = repr((
+            scenario.__module__, scenario.__qualname__,
+            ResultCache._code_hash(scenario.__module__), self.version,
+            str(config), arguments, seed
+        ))
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _code_hash(module):
+        with open(inspect.getfile(sys.modules[module]), 'rb') as file:
+            return hashlib.sha256(file.read()).hexdigest()
+
+    def load(self, key):
+        try:
+            with open(self._file(key), 'rb') as file:
+                return pickle.load(file)
+        except FileNotFoundError:
+            return None
+
+    def store(self, key, result):
+        # written next to the target and renamed over it, so a killed run
+        # never leaves a truncated entry behind
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                pickle.dump(result, file)
+            os.replace(tmp, self._file(key))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def _file(self, key):
+        return os.path.join(self.path, f'{key}.pkl')
+
+
+class SweepRunner:
+    def __init__(self,
+        scenario, config, spare_cores=1, chunksize=1, seed=0,
+        loglevel=logging.CRITICAL, formalism=QFormalism.DM, cache=None,
+        trace=None, text=True
+    ):
+        self.scenario = scenario
+        self.config = config
+        self.spare_cores = spare_cores
+        self.chunksize = chunksize
+        # a fixed root seed keeps point seeds, and so cache keys, stable
+        # between runs, pass a different one for independent repetitions
+        self.seed = seed
+        self.loglevel = loglevel
+        self.formalism = formalism
+        self.trace = trace
+        self.text = text
+        self.cache = ResultCache(cache) if isinstance(cache, str) else cache
+
+    def run(self, grid, **kwargs):
+        points = SweepRunner.points(grid)
+        if not points:
+            raise ValueError('The sweep grid has no points.')
+        keys = list(points[0].keys())
+
+        rows = []
+        tasks = []
+        cache_keys = dict()
+        for point in points:
+            config, params = self.resolve(point, kwargs)
+            seed = self.point_seed(point)
+            if self.cache is not None:
+                key = self.cache.key(self.scenario, config, params, seed)
+                result = self.cache.load(key)
+                if result is not None:
+                    rows.append({**point, **result})
+                    continue
+                cache_keys[SweepRunner._point_id(point)] = key
+            tasks.append((self.scenario, config, params, seed, point))
+
+        if tasks:
+            with Pool(
+                cpu_count()-self.spare_cores,
+                initializer=simulation,
+                initargs=(self.loglevel, self.formalism, self.trace, self.text)
+            ) as pool:
+                results = pool.imap_unordered(_run_sweep_point, tasks, self.chunksize)
+                for point, result in tqdm(results, total=len(tasks)):
+                    if self.cache is not None:
+                        self.cache.store(cache_keys[SweepRunner._point_id(point)], result)
+                    rows.append({**point, **result})
+
+        return pd.DataFrame(rows).set_index(keys).sort_index()
+
+    def resolve(self, point, kwargs):
+        params = dict(kwargs)
+        overrides = dict()
+        for key, value in point.items():
+            if '.' in key: overrides[key] = value
+            else: params[key] = value
+        config = self.config.override(overrides) if overrides else self.config
+        return config, params
+
+    def point_seed(self, point):
+        # derived from the point itself, so a point gets the same stream
+        # no matter which grid or worker it ends up in
+        digest = zlib.crc32(SweepRunner._point_id(point).encode())
+        return int(np.random.SeedSequence([self.seed, digest]).generate_state(1)[0])
+
+    @staticmethod
+    def points(grid):
+        if isinstance(grid, dict):
+            keys = list(grid.keys())
+            return [dict(zip(keys, values)) for values in product(*grid.values())]
+        return [dict(point) for point in grid]
+
+    @staticmethod
+    def _point_id(point):
+        return repr(sorted(point.items()))
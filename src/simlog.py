@@ -1,6 +1,9 @@
-
+import os
+import re
+import atexit
 import datetime
 import logging
+import numpy as np
 import netsquid as ns
 from enum import Enum
 
@@ -20,22 +23,105 @@ class log:
         MICROSECONDS = ('us', ns.MICROSECOND)
         NANOSECONDS = ('ns', ns.NANOSECOND)
 
+    class Trace:
+        def __init__(self, path, buffer_size=65536):
+            self.path = path
+            self.buffer_size = buffer_size
+            self.names = dict()
+            self.events = dict()
+            self._rows = []
+            self._chunks = []
+            self._parts = 0
+
+        def record(self, time, level, layer, action, name, event, args):
+            names, events = self.names, self.events
+            self._rows.append((
+                time, level, layer, action,
+                names.setdefault(name, len(names)),
+                events.setdefault(event, len(events)),
+                args
+            ))
+            if len(self._rows) >= self.buffer_size:
+                self.flush()
+
+        def flush(self):
+            if not self._rows:
+                return
+            [time, level, layer, action, name, event, args] = zip(*self._rows)
+            self._chunks.append(dict(
+                time=np.array(time, dtype=np.float64),
+                level=np.array(level, dtype='U1'),
+                layer=np.array(layer, dtype='U1'),
+                action=np.array(action, dtype='U1'),
+                name=np.array(name, dtype=np.int32),
+                event=np.array(event, dtype=np.int32),
+                # formatted only here, off the hot path of the simulation
+                args=np.array([', '.join(map(str, fields)) for fields in args], dtype=str)
+            ))
+            self._rows = []
+
+        def columns(self):
+            self.flush()
+            columns = {
+                key: np.concatenate([chunk[key] for chunk in self._chunks])
+                for key in log._TRACE_COLUMNS
+            } if self._chunks else {
+                key: np.array([]) for key in log._TRACE_COLUMNS
+            }
+            columns['names'] = np.array(list(self.names), dtype=str)
+            columns['events'] = np.array(list(self.events), dtype=str)
+            return columns
+
+        def write(self):
+            # every write goes to a new part holding only the rows since the
+            # last one, so frequent flushes do not rewrite the whole trace
+            self.flush()
+            if not self._chunks:
+                return
+            columns = self.columns()
+            path = log._trace_part(self.path, self._parts)
+            if path.endswith('.parquet'):
+                log._trace_frame(columns).to_parquet(path)
+            else:
+                np.savez_compressed(path, **columns)
+            self._chunks = []
+            self._parts += 1
+
+    _TRACE_COLUMNS = ['time', 'level', 'layer', 'action', 'name', 'event', 'args']
+
     _time_unit = TimeUnit.NANOSECONDS
+    _levels = dict(
+        D=logging.DEBUG,
+        I=logging.INFO,
+        W=logging.WARNING,
+        E=logging.ERROR,
+        C=logging.CRITICAL
+    )
+    _enabled = dict.fromkeys(_levels, False)
+    _level = logging.NOTSET
+    _layer_levels = dict()
+    _text = True
+    _trace = None
 
     def __init__(self):
         raise NotImplementedError('This class is not meant to be instantiated.')
-    
+
     @staticmethod
-    def init(level, time_unit=TimeUnit.NANOSECONDS):
-        current_datetime = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        log_file = logging.FileHandler(f"./log/sim_{current_datetime}.log")
-        log_file.setLevel(level)
+    def init(level, time_unit=TimeUnit.NANOSECONDS, trace=None, text=True):
         log._time_unit = time_unit
+        log._layer_levels = dict()
+        log._text = text
+        log.close()
+        log._trace = log.Trace(trace) if trace is not None else None
 
         for handler in ns.logger.handlers:
             ns.logger.removeHandler(handler)
-        ns.logger.setLevel(level)
-        ns.logger.addHandler(log_file)
+        if text:
+            current_datetime = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+            ns.logger.addHandler(logging.FileHandler(f"./log/sim_{current_datetime}.log"))
+        log.set_level(level)
+        if not text:
+            return
         unit = time_unit.value[0]
 
         ns.logger.critical(
@@ -52,34 +138,148 @@ f'''+---------------------------------------------------------------------------
         )
 
     @staticmethod
-    def debug(msg, **kwargs):
-        if ns.logger.level > logging.DEBUG:
-            the_msg = log._construct_message('D', msg, **kwargs)
-            ns.logger.debug(the_msg)
-    
+    def set_level(level, layer=None):
+        if layer is None:
+            log._level = level
+        else:
+            log._layer_levels[layer] = level
+
+        # the logger and its handlers let through the most verbose level of
+        # any layer, the per layer threshold is applied when emitting
+        lowest = min([log._level, *log._layer_levels.values()])
+        ns.logger.setLevel(lowest)
+        for handler in ns.logger.handlers:
+            handler.setLevel(lowest)
+        log._update_enabled()
+
+    @staticmethod
+    def is_enabled(level):
+        return log._enabled[level]
+
+    @staticmethod
+    def flush():
+        # atexit does not run in pool workers, so tasks flush on their own
+        if log._trace is not None:
+            log._trace.write()
+
+    @staticmethod
+    @atexit.register
+    def close():
+        log.flush()
+        log._trace = None
+
+    @staticmethod
+    def load_trace(path):
+        import pandas as pd
+        root, ext = os.path.splitext(path)
+        pattern = re.compile(re.escape(os.path.basename(root)) + r'\.(\d+)' + re.escape(ext) + '$')
+        parts = sorted(
+            (int(match.group(1)), os.path.join(os.path.dirname(path), file))
+            for file in os.listdir(os.path.dirname(path) or '.')
+            for match in [pattern.match(file)] if match
+        )
+        frames = []
+        for _, part in parts:
+            if ext == '.parquet':
+                frames.append(pd.read_parquet(part))
+            else:
+                with np.load(part) as data:
+                    frames.append(log._trace_frame(dict(data)))
+        if not frames:
+            return pd.DataFrame(columns=log._TRACE_COLUMNS)
+        # parts carry their own categories, merged back after concatenation
+        df = pd.concat(frames, ignore_index=True)
+        for key in ['level', 'layer', 'action', 'name', 'event']:
+            df[key] = df[key].astype(str).astype('category')
+        return df
+
+    @staticmethod
+    def debug(msg, *args, **kwargs):
+        if log._enabled['D']:
+            log._emit('D', msg, args, kwargs)
+
     @staticmethod
-    def info(msg, **kwargs):
-        if ns.logger.level > logging.DEBUG:
-            the_msg = log._construct_message('I', msg, **kwargs)
-            ns.logger.info(the_msg)
+    def info(msg, *args, **kwargs):
+        if log._enabled['I']:
+            log._emit('I', msg, args, kwargs)
 
     @staticmethod
-    def warning(msg, **kwargs):
-        if ns.logger.level > logging.DEBUG:        
-            the_msg = log._construct_message('W', msg, **kwargs)
-            ns.logger.warning(the_msg)
+    def warning(msg, *args, **kwargs):
+        if log._enabled['W']:
+            log._emit('W', msg, args, kwargs)
 
     @staticmethod
-    def error(msg, **kwargs):    
-        if ns.logger.level > logging.DEBUG:
-            the_msg = log._construct_message('E', msg, **kwargs)
-            ns.logger.error(the_msg)
+    def error(msg, *args, **kwargs):
+        if log._enabled['E']:
+            log._emit('E', msg, args, kwargs)
 
     @staticmethod
-    def critical(msg, **kwargs):
-        if ns.logger.level > logging.DEBUG:
-            the_msg = log._construct_message('C', msg, **kwargs)
-            ns.logger.critical(the_msg)
+    def critical(msg, *args, **kwargs):
+        if log._enabled['C']:
+            log._emit('C', msg, args, kwargs)
+
+    @staticmethod
+    def _update_enabled():
+        # resolved once per level change, so a disabled call is a single
+        # dict lookup and the message is never formatted
+        level = ns.logger.getEffectiveLevel()
+        log._enabled = {
+            code: levelno >= level and (log._text or log._trace is not None)
+            for code, levelno in log._levels.items()
+        }
+
+    @staticmethod
+    def _emit(level, msg, args, kwargs):
+        obj, action = log._target(kwargs)
+        layer = getattr(obj, 'log_layer', log.Layer.NONE)
+        if log._levels[level] < log._layer_levels.get(layer, log._level):
+            return
+
+        if log._trace is not None:
+            fields = args
+            if callable(msg):
+                event = f'{msg.__module__}.{msg.__qualname__}'
+                if not args:
+                    fields = (msg(),)
+            else:
+                event = msg
+            log._trace.record(
+                ns.sim_time(), level, layer.value, action,
+                obj.name if obj else '', event, fields
+            )
+
+        if log._text:
+            ns.logger.log(
+                log._levels[level],
+                log._construct_message(level, msg, args, **kwargs)
+            )
+
+    @staticmethod
+    def _target(kwargs):
+        if 'at' in kwargs:
+            return kwargs['at'], '@'
+        elif 'into' in kwargs:
+            return kwargs['into'], '>'
+        elif 'outof' in kwargs:
+            return kwargs['outof'], '<'
+        return None, '-'
+
+    @staticmethod
+    def _trace_part(path, part):
+        root, ext = os.path.splitext(path)
+        return f'{root}.{part}{ext}'
+
+    @staticmethod
+    def _trace_frame(columns):
+        import pandas as pd
+        df = pd.DataFrame({
+            key: columns[key] for key in log._TRACE_COLUMNS
+        })
+        for key in ['level', 'layer', 'action']:
+            df[key] = df[key].astype('category')
+        df['name'] = pd.Categorical.from_codes(df['name'], columns['names'])
+        df['event'] = pd.Categorical.from_codes(df['event'], columns['events'])
+        return df
 
     @staticmethod
     def _log_time():
@@ -101,20 +301,15 @@ f'''+---------------------------------------------------------------------------
             data_str = ''
 
         return f'{label}{data_str}'
-    
+
     @staticmethod
-    def _construct_message(level, msg, **kwargs):
-        if 'at' in kwargs:
-            obj = kwargs['at']
-            action = '@'
-        elif 'into' in kwargs:
-            obj = kwargs['into']
-            action = '>'
-        elif 'outof' in kwargs:
-            obj = kwargs['outof']
-            action = '<'
-        else:
-            obj = None
+    def _construct_message(level, msg, args=(), **kwargs):
+        if callable(msg):
+            msg = msg(*args)
+        elif args:
+            msg = msg % args
+
+        obj, action = log._target(kwargs)
 
         layer = log.Layer.NONE.value
         prefix = '-' * 12
@@ -123,7 +318,10 @@ f'''+---------------------------------------------------------------------------
             prefix = f'{action} {name:10}'
             if hasattr(obj, 'log_layer'):
                 layer = obj.log_layer.value
-        
+
         unit = log._time_unit.value
         time = ns.sim_time() / unit[1]
         return f'{level}{layer} {time:5.0f} {prefix}: {msg}'
+
+
+log._update_enabled()
@@ -0,0 +1,205 @@
+
+import numpy as np
+import netsquid as ns
+from netsquid.util.simtools import MICROSECOND, MILLISECOND
+
+from components.hardware import NVCProcessor
+from components.protocols import bell_diagonal as bd
+from components.protocols.link import LinkDescriptor, PurificationModel
+
+
+def werner(F):
+    return np.array([F, (1-F)/3, (1-F)/3, (1-F)/3])
+
+
+def create_processors():
+    ns.sim_reset()
+    return [
+        NVCProcessor(
+            T1=200*MILLISECOND, T2=100*MILLISECOND, num_in_centre=4,
+            t_gate=1*MICROSECOND, t_CX=2*MICROSECOND,
+            t_init=3*MICROSECOND, t_readout=4*MICROSECOND,
+            name=name
+        )
+        for name in ['AlicePROC', 'BobPROC']
+    ]
+
+
+def test_dejmps_purifies_werner_states():
+    F = 0.9
+    e = (1 - F) / 3
+
+    p, out = bd.dejmps(werner(F), werner(F))
+
+    assert np.isclose(p, F**2 + 2*F*e + 5*e**2)
+    assert np.isclose(bd.fidelity(out), (F**2 + e**2) / p)
+
+
+def test_dejmps_parities_add_up():
+    rng = np.random.default_rng(0)
+    coeffs1 = rng.random(4); coeffs1 /= coeffs1.sum()
+    coeffs2 = rng.random(4); coeffs2 /= coeffs2.sum()
+
+    p, out = bd.dejmps(coeffs1, coeffs2)
+    q, odd = bd.dejmps_odd(coeffs1, coeffs2)
+
+    assert np.isclose(p + q, 1)
+    assert np.isclose(out.sum(), 1)
+    assert np.isclose(odd.sum(), 1)
+
+
+def test_dejmps_odd_parity_output():
+    psi = np.eye(4)[bd.PSI_PLUS]
+    phi = np.eye(4)[bd.PHI_PLUS]
+
+    q, odd = bd.dejmps_odd(psi, phi)
+    assert q == 1
+    assert np.allclose(odd, psi)
+
+    # perfect pairs never give odd parity
+    q, _ = bd.dejmps_odd(phi, phi)
+    assert q == 0
+
+
+def test_purification_model_follows_dejmps():
+    desc = LinkDescriptor(
+        2, qfc_eff=1, collection_eff=1, detection_eff=1,
+        init_time=8*MICROSECOND, init_fidelity=0.99, correction_time=10,
+        L0=50, T1=3600, T2=1.46
+    )
+    model = PurificationModel(desc, ladder_iter=1)
+
+    base = bd.from_dm(desc.dm)
+    p, out = bd.dejmps(base, base)
+    assert np.allclose(model.levels[0], base)
+    assert np.allclose(model.coeffs, out)
+    assert np.isclose(model.p_keep[0][0], p)
+    assert model.fidelity() > bd.fidelity(base)
+
+
+def test_readout_errors_keep_odd_parity_pairs():
+    desc = LinkDescriptor(
+        2, qfc_eff=1, collection_eff=1, detection_eff=1,
+        init_time=8*MICROSECOND, init_fidelity=0.99, correction_time=10,
+        L0=50, T1=3600, T2=1.46
+    )
+    model = PurificationModel(desc, ladder_iter=1, F_readout=0.9)
+
+    base = bd.from_dm(desc.dm)
+    p, out = bd.dejmps(base, base)
+    q, odd = bd.dejmps_odd(base, base)
+    flip = 2 * 0.1 * 0.9
+    p_keep = (1 - flip) * p + flip * q
+    assert np.isclose(model.p_keep[0][0], p_keep)
+    assert np.allclose(model.coeffs, ((1 - flip) * p * out + flip * q * odd) / p_keep)
+
+
+I = np.eye(2)
+X = np.array([[0, 1], [1, 0]])
+Z = np.diag([1, -1])
+H = np.array([[1, 1], [1, -1]]) / np.sqrt(2)
+
+
+def on(gate, k):
+    ops = [I] * 4
+    ops[k] = gate
+    return np.kron(np.kron(ops[0], ops[1]), np.kron(ops[2], ops[3]))
+
+
+def cnot(ctrl, tgt):
+    return on(np.diag([1, 0]), ctrl) + on(np.diag([0, 1]), ctrl) @ on(X, tgt)
+
+
+def apply(dm, op):
+    return op @ dm @ op.conj().T
+
+
+def depolar(dm, k, F):
+    paulis = [I, X, X @ Z, Z]
+    return F * dm + (1 - F) / 4 * sum(apply(dm, on(P, k)) for P in paulis)
+
+
+def misread(dm, k, F):
+    return F * dm + (1 - F) * apply(dm, on(X, k))
+
+
+def outcomes(dm, measured, results):
+    dm = dm.reshape([2]*8)
+    index = [slice(None)] * 8
+    for k, m in zip(measured, results):
+        index[k] = index[k+4] = m
+    return dm[tuple(index)].reshape(4, 4)
+
+
+def test_gate_noise_matches_full_circuit():
+    F_gate, F_CX, F_readout = 0.95, 0.9, 0.97
+    c1 = np.array([0.8, 0.1, 0.06, 0.04])
+    c2 = np.array([0.85, 0.05, 0.07, 0.03])
+
+    # swap on the middle qubits of A R1 R2 B, then corrections on B
+    dm = np.kron(bd.to_dm(c1), bd.to_dm(c2))
+    dm = apply(dm, cnot(1, 2))
+    dm = depolar(depolar(dm, 1, F_CX), 2, F_CX)
+    dm = depolar(apply(dm, on(H, 1)), 1, F_gate)
+    dm = misread(misread(dm, 1, F_readout), 2, F_readout)
+    power = np.linalg.matrix_power
+    swapped = sum(
+        apply(outcomes(dm, [1, 2], [mZ, mX]), np.kron(I, power(Z, mZ) @ power(X, mX)))
+        for mZ in [0, 1] for mX in [0, 1]
+    )
+    assert np.allclose(bd.from_dm(swapped), bd.noisy_swap(c1, c2, F_gate, F_CX, F_readout))
+
+    # DEJMPS on A1 B1 A2 B2, the first pair is kept on matching readouts
+    rot = lambda angle: np.cos(angle/2) * I - 1j * np.sin(angle/2) * X
+    dm = np.kron(bd.to_dm(c1), bd.to_dm(c2))
+    for k, angle in enumerate([np.pi/2, -np.pi/2, np.pi/2, -np.pi/2]):
+        dm = depolar(apply(dm, on(rot(angle), k)), k, F_gate)
+    dm = apply(dm, cnot(0, 2) @ cnot(1, 3))
+    for k in range(4):
+        dm = depolar(dm, k, F_CX)
+    dm = misread(misread(dm, 2, F_readout), 3, F_readout)
+    kept = sum(outcomes(dm, [2, 3], [m, m]) for m in [0, 1])
+    p = np.trace(kept).real
+
+    p_keep, coeffs = bd.noisy_dejmps(c1, c2, F_gate, F_CX, F_readout)
+    assert np.isclose(p_keep, p)
+    assert np.allclose(coeffs, bd.from_dm(kept / p))
+
+
+def test_dm_round_trip():
+    coeffs = np.array([0.7, 0.1, 0.15, 0.05])
+    assert np.allclose(bd.from_dm(bd.to_dm(coeffs)), coeffs)
+
+
+def test_swap_multiplies_pauli_errors():
+    phi_minus = np.eye(4)[bd.PHI_MINUS]
+    psi_plus = np.eye(4)[bd.PSI_PLUS]
+    assert np.allclose(bd.swap(phi_minus, psi_plus), np.eye(4)[bd.PSI_MINUS])
+
+
+def test_compact_purification_agrees_on_both_ends():
+    mem1, mem2 = create_processors()
+    kept = bd.BellPair(werner(0.9), mem1, 0, mem2, 0)
+    bd.BellPair(werner(0.9), mem1, 1, mem2, 1)
+    p, out = bd.dejmps(werner(0.9), werner(0.9))
+
+    np.random.seed(0)
+    assert bd.purify_pairs(mem1, 0, 1) == 0
+    result = bd.purify_pairs(mem2, 0, 1)
+
+    if result == 0:
+        assert np.allclose(kept.coeffs, out)
+        assert np.isclose(bd.pair_fidelity(mem1, 0, mem2, 0), out[bd.PHI_PLUS])
+    else:
+        assert result == 1
+        assert np.allclose(kept.coeffs, werner(0.9))
+
+
+def test_deallocate_forgets_compact_pairs():
+    mem1, mem2 = create_processors()
+    bd.BellPair(werner(0.9), mem1, 0, mem2, 0)
+
+    mem1.deallocate([0])
+
+    assert bd.pair_at(mem1, 0) is None
+    assert bd.pair_at(mem2, 0) is not None
@@ -0,0 +1,32 @@
+
+import numpy as np
+
+from components.hardware import QuantumFibre, ClassicalFibre
+
+
+def test_one_way_fibres_have_one_channel():
+    qfibre = QuantumFibre('Q', 2, one_way=True)
+    cfibre = ClassicalFibre('C', 2, one_way=True)
+
+    assert list(qfibre.subcomponents.keys()) == ['Q_A2B']
+    assert list(cfibre.subcomponents.keys()) == ['C_A2B']
+    assert len(QuantumFibre('Q2', 2).subcomponents) == 2
+
+
+def test_fibres_share_models():
+    fibre1 = QuantumFibre('Q1', 2)
+    fibre2 = QuantumFibre('Q2', 2)
+    cfibre = ClassicalFibre('C', 5)
+
+    channel1 = fibre1.subcomponents['Q1_A2B']
+    channel2 = fibre2.subcomponents['Q2_A2B']
+    for model in ['quantum_noise_model', 'quantum_loss_model', 'delay_model']:
+        assert channel1.models[model] is channel2.models[model]
+    assert cfibre.subcomponents['C_A2B'].models['delay_model'] is channel1.models['delay_model']
+
+
+def test_lossless_fibre_reports_transmittance():
+    fibre = QuantumFibre('Q', 10, attenuation=0.2, lossless=True)
+
+    assert fibre.subcomponents['Q_A2B'].models.get('quantum_loss_model') is None
+    assert np.isclose(fibre.transmittance(), 10**-0.2)
@@ -0,0 +1,129 @@
+
+import numpy as np
+import netsquid as ns
+from netsquid.nodes import Node
+from netsquid.protocols import NodeProtocol
+from netsquid.util.simtools import MICROSECOND, MILLISECOND
+
+from components.hardware import NVCProcessor
+from components.protocols.link import LinkDescriptor, LinkResponseType, StateInsertionProtocol
+
+
+def create_nodes():
+    ns.sim_reset()
+    return [
+        Node(name, qmemory=NVCProcessor(
+            T1=200*MILLISECOND, T2=100*MILLISECOND, num_in_centre=4,
+            t_gate=1*MICROSECOND, t_CX=2*MICROSECOND,
+            t_init=3*MICROSECOND, t_readout=4*MICROSECOND,
+            name=f'{name}PROC'
+        ))
+        for name in ['Alice', 'Bob']
+    ]
+
+
+DESCRIPTOR_PARAMS = dict(
+    qfc_eff=1, collection_eff=1, detection_eff=1,
+    init_time=8*MICROSECOND, init_fidelity=0.99, correction_time=10,
+    L0=50, T1=3600, T2=1.46, clk=10*MICROSECOND
+)
+
+
+def create_descriptor(distance=2):
+    return LinkDescriptor.cached(distance, **DESCRIPTOR_PARAMS)
+
+
+class PairCollector (NodeProtocol):
+    def __init__(self, node, link, name=None):
+        super().__init__(node, name)
+        self.add_subprotocol(link, name='link')
+        self.link = link
+        self.time = None
+        self.resp = None
+
+    def run(self):
+        self.start_subprotocols()
+        req = self.link.request_entanglement(count=1, response_type=LinkResponseType.CONSECUTIVE)
+        self.resp = yield from req.await_as(self)
+        self.time = ns.sim_time()
+
+
+def run_insertion(fast_forward, seed=0):
+    alice, bob = create_nodes()
+    link = StateInsertionProtocol(alice, bob, create_descriptor(), fast_forward=fast_forward, seed=seed)
+    alice_link, bob_link = link.node_protocols()
+    link.start()
+    collectors = [PairCollector(alice, alice_link), PairCollector(bob, bob_link)]
+    for collector in collectors:
+        collector.start()
+    ns.sim_run()
+    return collectors
+
+
+def test_fast_forward_skips_busy_periods():
+    alice, bob = create_nodes()
+    link = StateInsertionProtocol(alice, bob, create_descriptor(), fast_forward=True)
+    link._busy_periods = [(2, 5), (10, 12)]
+
+    insert_time, idle = link._project_generation(0, 6)
+
+    assert insert_time == 9
+    assert idle == [(0, 2), (5, 4)]
+
+
+def test_fast_forward_drops_earlier_busy_periods():
+    alice, bob = create_nodes()
+    link = StateInsertionProtocol(alice, bob, create_descriptor(), fast_forward=True)
+    link._busy_periods = [(0, 3), (4, 6)]
+
+    insert_time, idle = link._project_generation(4, 1)
+
+    assert insert_time == 7
+    assert idle == [(6, 1)]
+    assert link._busy_periods == [(4, 6)]
+
+
+def test_fast_forward_matches_regular_engine():
+    desc = create_descriptor()
+    [tries, *_] = np.random.default_rng(0).geometric(desc.p, size=StateInsertionProtocol.TRIES_BLOCK)
+
+    for fast_forward in [False, True]:
+        collectors = run_insertion(fast_forward)
+        [alice, bob] = collectors
+        assert alice.time == bob.time == tries * desc.clk
+        assert alice.resp.qubit.id == bob.resp.qubit.id
+
+
+def test_descriptors_are_cached():
+    LinkDescriptor.clear_cache()
+    desc = create_descriptor()
+
+    assert create_descriptor() is desc
+    assert create_descriptor(distance=4) is not desc
+
+
+def test_grid_matches_single_descriptors():
+    LinkDescriptor.clear_cache()
+    descs = LinkDescriptor.grid([2, 4], **DESCRIPTOR_PARAMS)
+
+    for distance, desc in zip([2, 4], descs):
+        single = LinkDescriptor(distance, **DESCRIPTOR_PARAMS)
+        assert np.allclose(desc.dm, single.dm)
+        assert np.isclose(desc.p, single.p)
+        assert desc.clk == single.clk
+        assert create_descriptor(distance) is desc
+
+
+def test_tries_are_drawn_in_blocks():
+    alice, bob = create_nodes()
+    desc = create_descriptor()
+    link = StateInsertionProtocol(alice, bob, desc, seed=1)
+
+    tries = [link._next_tries() for _ in range(StateInsertionProtocol.TRIES_BLOCK + 1)]
+
+    rng = np.random.default_rng(1)
+    expected = np.concatenate([
+        rng.geometric(desc.p, size=StateInsertionProtocol.TRIES_BLOCK),
+        rng.geometric(desc.p, size=StateInsertionProtocol.TRIES_BLOCK)[:1]
+    ])
+    assert tries == expected.tolist()
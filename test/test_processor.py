@@ -0,0 +1,275 @@
+
+import pytest
+import numpy as np
+import netsquid as ns
+from netsquid.nodes import Node
+from netsquid.protocols import NodeProtocol
+from netsquid.qubits import create_qubits
+from netsquid.components.qmemory import QuantumMemoryError, MemoryPosition
+from netsquid.components.models.qerrormodels import QuantumErrorModel
+from netsquid.components.instructions import INSTR_INIT, INSTR_X, INSTR_CNOT
+from netsquid.util.simtools import MICROSECOND, MILLISECOND
+
+from components.hardware import NVCProcessor, program_function, ProgramPriority
+from components.hardware.nvcprocessor import (
+    RecordedProgram, UsageTimeline, _instruction_set, _memory_noise
+)
+
+
+def create_node(**kwargs):
+    ns.sim_reset()
+    return Node('Node', qmemory=NVCProcessor(
+        T1=200*MILLISECOND, T2=100*MILLISECOND, num_in_centre=4,
+        t_gate=1*MICROSECOND, t_CX=2*MICROSECOND,
+        t_init=3*MICROSECOND, t_readout=4*MICROSECOND,
+        name='NodePROC', **kwargs
+    ))
+
+
+class ProgramRunner (NodeProtocol):
+    def __init__(self, node, positions, name=None):
+        super().__init__(node, name)
+        self.positions = positions
+        self.finished = None
+
+    def run(self):
+        yield from self.init_flip(self.positions)
+        self.finished = ns.sim_time()
+
+    @program_function(1, ProgramPriority.LOW, 'test')
+    def init_flip(self, prog, qubits):
+        prog.apply(INSTR_INIT, qubits)
+        prog.apply(INSTR_X, qubits)
+
+
+class ScheduledProgram (NodeProtocol):
+    def __init__(self, node, positions, priority, finished, name=None):
+        super().__init__(node, name)
+        self.positions = positions
+        self.priority = priority
+        self.finished = finished
+
+    def run(self):
+        prog = RecordedProgram(len(self.positions))
+        for i in range(len(self.positions)):
+            prog.apply(INSTR_X, i)
+        yield from self.node.qmemory.schedule_program(prog, self.priority, self.positions, self.name)
+        self.finished.append((self.name, ns.sim_time()))
+
+
+def schedule_programs(node, programs):
+    finished = []
+    for name, positions, priority in programs:
+        ScheduledProgram(node, positions, priority, finished, name=name).start()
+    ns.sim_run()
+    return finished
+
+
+class CNOTRunner (NodeProtocol):
+    def __init__(self, node, pairs, name=None):
+        super().__init__(node, name)
+        self.pairs = pairs
+        self.finished = []
+
+    def run(self):
+        for pair in self.pairs:
+            yield from self.cnot(pair)
+            self.finished.append(ns.sim_time())
+
+    @program_function(2, ProgramPriority.LOW, 'cnot')
+    def cnot(self, prog, qubits):
+        prog.apply(INSTR_CNOT, qubits)
+
+
+class SlotWaiter (NodeProtocol):
+    def __init__(self, node, partition, name=None):
+        super().__init__(node, name)
+        self.partition = partition
+        self.allocated = None
+
+    def run(self):
+        yield self.node.qmemory.await_free(self.partition)
+        self.allocated = (ns.sim_time(), self.node.qmemory.allocate(1, self.partition))
+
+
+class SlotReleaser (NodeProtocol):
+    def __init__(self, node, releases, name=None):
+        super().__init__(node, name)
+        self.releases = releases
+
+    def run(self):
+        for time, positions in self.releases:
+            yield self.await_timer(end_time=time)
+            self.node.qmemory.deallocate(positions)
+
+
+def test_usage_is_recorded():
+    node = create_node()
+    runner = ProgramRunner(node, [0])
+    runner.start()
+    ns.sim_run()
+
+    assert runner.finished == 4*MICROSECOND
+    assert node.qmemory.usage_info['test'] == 4*MICROSECOND
+    assert list(node.qmemory.usage_timeline) == [(0.0, 4*MICROSECOND, 'test')]
+
+
+def test_programs_run_by_priority():
+    node = create_node()
+    node.qmemory.put(create_qubits(4), positions=[0, 1, 2, 3])
+
+    finished = schedule_programs(node, [
+        ('first', [0], ProgramPriority.LOW),
+        ('low', [1], ProgramPriority.LOW),
+        ('high', [2], ProgramPriority.HIGH),
+        ('real_time', [3], ProgramPriority.REAL_TIME)
+    ])
+
+    assert finished == [
+        ('first', 1*MICROSECOND),
+        ('real_time', 2*MICROSECOND),
+        ('high', 3*MICROSECOND),
+        ('low', 4*MICROSECOND)
+    ]
+
+
+def test_disjoint_programs_are_fused():
+    node = create_node(fuse_programs=True)
+    node.qmemory.put(create_qubits(3), positions=[0, 1, 2])
+
+    finished = schedule_programs(node, [
+        ('first', [0], ProgramPriority.LOW),
+        ('a', [1], ProgramPriority.LOW),
+        ('b', [2], ProgramPriority.LOW)
+    ])
+
+    assert finished == [
+        ('first', 1*MICROSECOND),
+        ('a', 3*MICROSECOND),
+        ('b', 3*MICROSECOND)
+    ]
+    assert list(node.qmemory.usage_timeline) == [
+        (0.0, 1*MICROSECOND, 'first'),
+        (1*MICROSECOND, 1*MICROSECOND, 'a'),
+        (2*MICROSECOND, 1*MICROSECOND, 'b')
+    ]
+    # the fused program still runs its instructions one after the other
+    assert 'fusion_saved' not in node.qmemory.usage_info
+
+
+def test_timeline_ring_keeps_latest_entries():
+    timeline = UsageTimeline(capacity=2)
+    timeline.append(0, 1, 'a')
+    timeline.append(1, 1, 'b')
+    timeline.append(2, 1, 'a')
+
+    assert len(timeline) == 2
+    assert list(timeline) == [(1.0, 1.0, 'b'), (2.0, 1.0, 'a')]
+
+
+def test_timeline_bins_split_usage():
+    timeline = UsageTimeline(bin_width=10)
+    timeline.append(5, 10, 'a')
+    timeline.append(12, 3, 'b')
+
+    columns = timeline.columns()
+    assert list(columns['reasons']) == ['a', 'b']
+    assert np.allclose(columns['bins'], [[5, 0], [5, 3]])
+
+
+def test_allocate_lowest_free_positions():
+    mem = create_node().qmemory
+
+    assert mem.allocate(2) == [0, 1]
+    mem.deallocate([0])
+    assert mem.allocate(2) == [0, 2]
+    assert mem.allocate(1, [3]) == [3]
+    with pytest.raises(QuantumMemoryError):
+        mem.allocate(1, [3])
+    with pytest.raises(QuantumMemoryError):
+        mem.allocate(2, [3])
+
+
+def test_allocate_skips_positions_in_use():
+    mem = create_node().qmemory
+    mem.put(create_qubits(1), positions=[0])
+    mem.mem_positions[0].in_use = True
+    mem.mem_positions[1].in_use = True
+
+    assert mem.allocate(2) == [2, 3]
+    with pytest.raises(QuantumMemoryError):
+        mem.allocate(1)
+    # a failed allocation hands back nothing
+    mem.deallocate([1])
+    assert mem.allocate(1) == [1]
+
+
+def test_freed_partition_wakes_waiter():
+    node = create_node()
+    node.qmemory.allocate(4)
+    waiter = SlotWaiter(node, [2, 3])
+    releaser = SlotReleaser(node, [(2*MICROSECOND, [0]), (5*MICROSECOND, [3])])
+    waiter.start()
+    releaser.start()
+    ns.sim_run()
+
+    # freeing a position outside the partition does not wake it
+    assert waiter.allocated == (5*MICROSECOND, [3])
+
+
+def test_processors_share_instructions():
+    _instruction_set.cache_clear()
+    create_node(centre_count=2, t_iCX=5*MICROSECOND)
+    create_node(centre_count=2, t_iCX=5*MICROSECOND)
+
+    assert _instruction_set.cache_info().misses == 1
+    assert _instruction_set.cache_info().hits == 1
+
+
+def shared_state(objects):
+    return [{key: repr(value) for key, value in vars(obj).items()} for obj in objects]
+
+
+def test_shared_instructions_are_not_bound():
+    _instruction_set.cache_clear()
+    node = create_node(F_gate=0.9, F_CX=0.9, F_readout=0.9)
+    instr = _instruction_set(
+        1, 4, 1*MICROSECOND, 2*MICROSECOND, 3*MICROSECOND, 4*MICROSECOND, 2*MICROSECOND,
+        0.9, 0.9, 1, 0.9, 0.9
+    )
+    models = [
+        value for i in instr for value in vars(i).values()
+        if isinstance(value, QuantumErrorModel)
+    ] + [_memory_noise(200*MILLISECOND, 100*MILLISECOND)]
+    before = shared_state(instr + tuple(models))
+
+    runner = ProgramRunner(node, [0])
+    runner.start()
+    ns.sim_run()
+    other = NVCProcessor(
+        T1=200*MILLISECOND, T2=100*MILLISECOND, num_in_centre=4,
+        t_gate=1*MICROSECOND, t_CX=2*MICROSECOND,
+        t_init=3*MICROSECOND, t_readout=4*MICROSECOND,
+        F_gate=0.9, F_CX=0.9, F_readout=0.9, name='OtherPROC'
+    )
+
+    assert _instruction_set.cache_info().hits == 2
+    assert _instruction_set.cache_info().maxsize is not None
+    # running a program or building another processor leaves them untouched
+    assert shared_state(instr + tuple(models)) == before
+    for obj in instr + tuple(models):
+        assert not any(
+            value is node.qmemory or value is other or isinstance(value, MemoryPosition)
+            for value in vars(obj).values()
+        )
+
+
+def test_cnot_duration_follows_centres():
+    node = create_node(centre_count=2, t_iCX=5*MICROSECOND)
+    node.qmemory.put(create_qubits(3), positions=[0, 1, 4])
+    runner = CNOTRunner(node, [[0, 1], [0, 4]])
+    runner.start()
+    ns.sim_run()
+
+    # the first pair shares a centre, the second does not
+    assert runner.finished == [2*MICROSECOND, 7*MICROSECOND]
@@ -0,0 +1,114 @@
+
+import netsquid as ns
+from netsquid.nodes import Node
+from netsquid.qubits import create_qubits
+from netsquid.util.simtools import MICROSECOND, MILLISECOND, SECOND
+
+from components.hardware import NVCProcessor
+from components.protocols.util import EntanglementRecord
+from components.protocols.net import SwapWithRepeaterProtocol
+from components.protocols.net.repeater_protocol import _RepEtgmManagerMinion
+
+
+class RecordingRepeater:
+    def __init__(self):
+        self.name = 'Rep'
+        self.sent = []
+
+    def send(self, port, items, header):
+        self.sent.append((port, items))
+
+
+def create_minion(cutoff_time=1*SECOND, num_in_centre=4, centre_count=1):
+    ns.sim_reset()
+    node = Node('Rep', qmemory=NVCProcessor(
+        T1=200*MILLISECOND, T2=100*MILLISECOND, num_in_centre=num_in_centre,
+        t_gate=1*MICROSECOND, t_CX=2*MICROSECOND,
+        t_init=3*MICROSECOND, t_readout=4*MICROSECOND,
+        centre_count=centre_count, name='RepPROC'
+    ))
+    node.qmemory.put(create_qubits(4), positions=[0, 1, 2, 3])
+    rep = RecordingRepeater()
+    minion = _RepEtgmManagerMinion(node, rep, 'RepMNGR')
+    minion.session = 'test'
+    minion.cutoff_time = cutoff_time
+    return minion, rep
+
+
+def test_track_waits_for_swap():
+    minion, rep = create_minion()
+
+    minion.track(dict(id='a', cX=False, cZ=False), 'next', 'last', True)
+    assert rep.sent == []
+
+    minion._swapped(EntanglementRecord(0, 'a'), EntanglementRecord(1, 'b'), True, False)
+    assert rep.sent == [
+        ('next', [SwapWithRepeaterProtocol.TRACK_MSG, dict(id='b', cX=True, cZ=False)])
+    ]
+
+
+def test_swap_records_are_pruned_once_tracked():
+    minion, rep = create_minion()
+    minion._swapped(EntanglementRecord(0, 'a'), EntanglementRecord(1, 'b'), False, True)
+    minion._swapped(EntanglementRecord(2, 'c'), EntanglementRecord(3, 'd'), False, False)
+
+    minion.track(dict(id='c', cX=False, cZ=False), 'next', 'last', True)
+    minion.track(dict(id='d', cX=False, cZ=False), 'last', 'next', False)
+
+    assert rep.sent == [
+        ('next', [SwapWithRepeaterProtocol.TRACK_MSG, dict(id='d', cX=False, cZ=False)]),
+        ('last', [SwapWithRepeaterProtocol.TRACK_MSG, dict(id='c', cX=False, cZ=False)])
+    ]
+    # the later swap is known on both ends, so is every older one
+    assert minion._swap_records == dict()
+    assert len(minion._swap_order) == 0
+
+
+def test_earlier_cutoff_replaces_the_timer():
+    minion, rep = create_minion(cutoff_time=20*MICROSECOND)
+    minion.start()
+    minion.register_downstream(EntanglementRecord(0, 'old'))
+    ns.sim_run(end_time=5*MICROSECOND)
+
+    # a younger qubit with a shorter cutoff expires behind the queue head
+    minion.cutoff_time = 2*MICROSECOND
+    minion.register_downstream(EntanglementRecord(1, 'young'))
+    ns.sim_run(end_time=10*MICROSECOND)
+
+    assert 'young' in minion._discard_records
+    assert [rec.qubit.id for rec in minion._downstream] == ['old']
+
+    ns.sim_run(end_time=25*MICROSECOND)
+    assert len(minion._downstream) == 0
+    assert 'old' in minion._discard_records
+
+
+def register_pairs(minion):
+    minion.start()
+    minion.register_upstream(EntanglementRecord(0, 'up1'))
+    minion.register_downstream(EntanglementRecord(1, 'down1'))
+    minion.register_upstream(EntanglementRecord(2, 'up2'))
+    minion.register_downstream(EntanglementRecord(3, 'down2'))
+    ns.sim_run(end_time=100*MICROSECOND)
+
+
+def test_pairs_on_separate_centres_are_swapped_by_one_program():
+    minion, rep = create_minion(num_in_centre=2, centre_count=2)
+    register_pairs(minion)
+
+    assert [(rec.id1, rec.id2) for rec in minion._swap_order] == [('up1', 'down1'), ('up2', 'down2')]
+    timeline = minion.node.qmemory.usage_timeline
+    assert [reason for _, _, reason in timeline] == ['swap']
+    # CNOT, H and two readouts for each pair
+    assert minion.node.qmemory.usage_info['swap'] == 2*(2 + 1 + 2*4)*MICROSECOND
+
+
+def test_pairs_on_one_centre_are_swapped_in_rounds():
+    minion, rep = create_minion()
+    register_pairs(minion)
+
+    assert [(rec.id1, rec.id2) for rec in minion._swap_order] == [('up1', 'down1'), ('up2', 'down2')]
+    timeline = minion.node.qmemory.usage_timeline
+    assert [(start, reason) for start, _, reason in timeline] == [
+        (0, 'swap'), ((2 + 1 + 2*4)*MICROSECOND, 'swap')
+    ]
@@ -0,0 +1,87 @@
+
+import pytest
+
+from config_reder import ConfigHolder
+from sim_spawn import SweepRunner, SimulationSpawner, ResultCache
+
+
+def add(a, b):
+    return a + b
+
+
+def scenario_with_default(default):
+    def scenario(config, dst, rounds=default):
+        return dict(dst=dst, rounds=rounds)
+    return scenario
+
+
+def test_sweep_points_from_grid():
+    points = SweepRunner.points(dict(dst=[10, 20], count=[1, 2]))
+    assert points == [
+        dict(dst=10, count=1), dict(dst=10, count=2),
+        dict(dst=20, count=1), dict(dst=20, count=2)
+    ]
+
+
+def test_point_seed_does_not_depend_on_grid():
+    runner = SweepRunner(None, None, seed=0)
+    other = SweepRunner(None, None, seed=0)
+
+    assert runner.point_seed(dict(dst=10, count=1)) == other.point_seed(dict(count=1, dst=10))
+    assert runner.point_seed(dict(dst=10, count=1)) != runner.point_seed(dict(dst=10, count=2))
+
+
+def test_dotted_keys_override_the_config():
+    config = ConfigHolder(fibre=dict(attenuation=0.2))
+    runner = SweepRunner(None, config, seed=0)
+
+    resolved, params = runner.resolve({'fibre.attenuation': 0.3, 'dst': 10}, dict(rounds=5))
+
+    assert resolved.fibre.attenuation == 0.3
+    assert config.fibre.attenuation == 0.2
+    assert params == dict(rounds=5, dst=10)
+
+
+def test_spawner_returns_results_in_order():
+    spawner = SimulationSpawner(add, spare_cores=0)
+
+    results = spawner.run([1, 2, 3], [10, 20, 30])
+
+    assert results == [11, 22, 33]
+    assert list(spawner.stream([1], [2])) == [3]
+
+
+def test_cache_key_covers_defaults(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    scenario = scenario_with_default(10)
+
+    key = cache.key(scenario, 'config', dict(dst=1), 0)
+
+    assert key == cache.key(scenario, 'config', dict(dst=1, rounds=10), 0)
+    assert key != cache.key(scenario_with_default(20), 'config', dict(dst=1), 0)
+    assert key != cache.key(scenario, 'config', dict(dst=1), 1)
+
+
+def test_cache_round_trip(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    key = cache.key(scenario_with_default(10), 'config', dict(dst=1), 0)
+
+    assert cache.load(key) is None
+    cache.store(key, dict(F=0.9))
+    assert cache.load(key) == dict(F=0.9)
+
+
+def test_empty_grid_is_rejected():
+    runner = SweepRunner(add, None, seed=0)
+
+    with pytest.raises(ValueError):
+        runner.run(dict(dst=[]))
+
+
+def test_cache_key_is_stable_and_versioned(tmp_path):
+    scenario = scenario_with_default(10)
+    key = ResultCache(str(tmp_path)).key(scenario, 'config', dict(dst=1), 0)
+
+    assert SweepRunner(scenario, None).seed == SweepRunner(scenario, None).seed
+    assert key == ResultCache(str(tmp_path)).key(scenario, 'config', dict(dst=1), 0)
+    assert key != ResultCache(str(tmp_path), version=2).key(scenario, 'config', dict(dst=1), 0)
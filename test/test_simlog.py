@@ -0,0 +1,65 @@
+
+import os
+import logging
+import numpy as np
+import netsquid as ns
+
+from simlog import log
+
+
+class Reporter:
+    def __init__(self, name, layer):
+        self.name = name
+        self.log_layer = layer
+
+
+def test_disabled_levels_skip_formatting(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('log')
+    log.init(logging.WARNING)
+
+    calls = []
+    log.info(lambda: calls.append('info') or 'info')
+    log.warning(lambda: calls.append('warning') or 'warning')
+
+    assert not log.is_enabled('I')
+    assert log.is_enabled('W')
+    assert calls == ['warning']
+
+
+def test_trace_records_formatted_fields(tmp_path):
+    path = str(tmp_path / 'trace.npz')
+    log.init(logging.INFO, trace=path, text=False)
+    phys = Reporter('Phys', log.Layer.PHYSICAL)
+    link = Reporter('Link', log.Layer.LINK)
+    log.set_level(logging.WARNING, log.Layer.LINK)
+
+    log.info('Sent %s', [1], at=phys)
+    log.info('Received %s', [1], into=link)
+    log.flush()
+
+    assert not any(isinstance(h, logging.FileHandler) for h in ns.logger.handlers)
+    trace = log.load_trace(path)
+    log.close()
+
+    assert trace['name'].tolist() == ['Phys']
+    assert trace['event'].tolist() == ['Sent %s']
+    assert trace['args'].tolist() == ['[1]']
+    assert trace['layer'].tolist() == [log.Layer.PHYSICAL.value]
+
+
+def test_trace_flushes_write_only_new_rows(tmp_path):
+    path = str(tmp_path / 'trace.npz')
+    log.init(logging.INFO, trace=path, text=False)
+    phys = Reporter('Phys', log.Layer.PHYSICAL)
+
+    log.info('First', at=phys)
+    log.flush()
+    log.flush()
+    log.info('Second', at=phys)
+    log.close()
+
+    assert sorted(os.listdir(tmp_path)) == ['trace.0.npz', 'trace.1.npz']
+    with np.load(str(tmp_path / 'trace.1.npz')) as part:
+        assert part['event'].tolist() == [1]
+    assert log.load_trace(path)['event'].tolist() == ['First', 'Second']
@@ -0,0 +1,102 @@
+
+import netsquid as ns
+from netsquid.nodes import Node
+from netsquid.protocols import NodeProtocol, Protocol
+from netsquid.util.simtools import MICROSECOND
+
+from components.protocols.util import MessageBatcher, Clock
+
+
+class MessageCollector (NodeProtocol):
+    def __init__(self, node, port, name=None):
+        super().__init__(node, name)
+        self.port = port
+        self.received = []
+
+    def run(self):
+        port = self.node.ports[self.port]
+        while True:
+            yield self.await_port_input(port)
+            msg = port.rx_input()
+            self.received.append((ns.sim_time(), msg.meta['header'], msg.items))
+
+
+class TickRequester (Protocol):
+    def __init__(self, clock, delay):
+        super().__init__()
+        self.clock = clock
+        self.delay = delay
+        self.ticked = None
+
+    def run(self):
+        yield self.await_timer(self.delay)
+        self.clock.request_tick()
+        yield self.await_signal(sender=self.clock, signal_label=Clock.TICK)
+        self.ticked = ns.sim_time()
+
+
+def create_batcher(window, max_messages):
+    ns.sim_reset()
+    sender = Node('Sender', port_names=['out'])
+    receiver = Node('Receiver', port_names=['in'])
+    sender.ports['out'].connect(receiver.ports['in'])
+
+    collector = MessageCollector(receiver, 'in')
+    collector.start()
+    batcher = MessageBatcher(sender, sender.ports['out'], window, max_messages)
+    batcher.start()
+    return batcher, collector
+
+
+def test_batcher_packs_messages_within_window():
+    batcher, collector = create_batcher(10*MICROSECOND, 3)
+
+    batcher.send(['a'], 'TRACK')
+    batcher.send(['b', 'c'], 'TRACK')
+    ns.sim_run()
+
+    assert collector.received == [(10*MICROSECOND, 'TRACK', ['a', 'b', 'c'])]
+
+
+def test_full_batch_is_sent_at_once():
+    batcher, collector = create_batcher(10*MICROSECOND, 2)
+
+    batcher.send(['a'], 'TRACK')
+    batcher.send(['b'], 'TRACK')
+    ns.sim_run()
+
+    assert collector.received == [(0, 'TRACK', ['a', 'b'])]
+
+
+def test_window_alone_batches_messages():
+    batcher, collector = create_batcher(10*MICROSECOND, None)
+
+    for item in ['a', 'b', 'c', 'd']:
+        batcher.send([item], 'TRACK')
+    ns.sim_run()
+
+    assert collector.received == [(10*MICROSECOND, 'TRACK', ['a', 'b', 'c', 'd'])]
+
+
+def test_no_window_or_size_sends_right_away():
+    batcher, collector = create_batcher(0, None)
+
+    batcher.send(['a'], 'TRACK')
+    batcher.send(['b'], 'TRACK')
+    ns.sim_run()
+
+    assert collector.received == [(0, 'TRACK', ['a']), (0, 'TRACK', ['b'])]
+
+
+def test_on_demand_clock_keeps_its_phase():
+    ns.sim_reset()
+    clock = Clock(10*MICROSECOND, on_demand=True)
+    requester = TickRequester(clock, 25*MICROSECOND)
+    clock.start()
+    requester.start()
+    # without pending attempts the clock schedules nothing and the run ends
+    ns.sim_run()
+
+    assert requester.ticked == 30*MICROSECOND
+    assert clock.tick_index(requester.ticked) == 3
+    assert clock.tick_count() == 1